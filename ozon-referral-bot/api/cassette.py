@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteResponse:
+    """Минимальная замена requests.Response для воспроизведения"""
+
+    def __init__(self, status_code: int, text: str, elapsed: float):
+        self.status_code = status_code
+        self.text = text
+        self.elapsed_seconds = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Cassette:
+    """
+    Кассета HTTP взаимодействий в формате JSON Lines: одна строка на запрос.
+
+    Хранится только то, что нужно для воспроизведения: метод, URL, код ответа,
+    тело ответа, время ответа или тип исключения. Тела запросов (персональные
+    данные кандидатов) не сохраняются.
+    """
+
+    def __init__(self, path: str, mode: str, timing: str = "none"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.real_timing = timing == "real"
+        self._lock = threading.Lock()
+        self._interactions: Dict[str, List[dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+
+        if mode == "replay":
+            self._load()
+        elif mode == "record":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _key(method: str, url: str) -> str:
+        return f"{method.upper()} {url}"
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    interaction = json.loads(line)
+                    self._interactions[self._key(interaction["method"], interaction["url"])].append(interaction)
+        total = sum(len(items) for items in self._interactions.values())
+        logger.info(f"Loaded {total} interactions from cassette {self.path}")
+
+    def record(self, method: str, url: str, elapsed: float,
+               response: Optional[requests.Response] = None, error: Optional[Exception] = None):
+        """Дописать взаимодействие в кассету"""
+        interaction = {"method": method.upper(), "url": url, "elapsed": round(elapsed, 4)}
+        if error is not None:
+            interaction["error"] = type(error).__name__
+            interaction["message"] = str(error)
+        else:
+            interaction["status"] = response.status_code
+            interaction["body"] = response.text
+
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def replay(self, method: str, url: str) -> CassetteResponse:
+        """
+        Вернуть следующий записанный ответ для метода и URL.
+        Записи отдаются по кругу, чтобы кассета подходила для долгих прогонов.
+        """
+        key = self._key(method, url)
+        interactions = self._interactions.get(key)
+        if not interactions:
+            raise requests.exceptions.ConnectionError(f"No recorded interactions for {key} in {self.path}")
+
+        with self._lock:
+            position = self._positions[key]
+            self._positions[key] = position + 1
+        if position == len(interactions):
+            logger.info(f"Cassette exhausted for {key}, replaying from the beginning")
+        interaction = interactions[position % len(interactions)]
+
+        if self.real_timing:
+            time.sleep(interaction["elapsed"])
+
+        if "error" in interaction:
+            error_class = getattr(requests.exceptions, interaction["error"], requests.exceptions.RequestException)
+            if not (isinstance(error_class, type) and issubclass(error_class, requests.exceptions.RequestException)):
+                error_class = requests.exceptions.RequestException
+            raise error_class(interaction["message"])
+
+        return CassetteResponse(interaction["status"], interaction["body"], interaction["elapsed"])
+
+
+class CassetteSession:
+    """Обертка над requests.Session, которая пишет или воспроизводит запросы через кассету"""
+
+    def __init__(self, session: requests.Session, cassette: Cassette):
+        self.session = session
+        self.cassette = cassette
+
+    def request(self, method: str, url: str, **kwargs):
+        if self.cassette.mode == "replay":
+            return self.cassette.replay(method, url)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.cassette.record(method, url, time.perf_counter() - started, error=e)
+            raise
+        self.cassette.record(method, url, time.perf_counter() - started, response=response)
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
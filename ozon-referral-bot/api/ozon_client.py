@@ -1,25 +1,71 @@
 import requests
 import json
-from typing import Dict, Any, Optional
-from config.settings import OZON_API_URL, OZON_HEADERS, OZON_COOKIE
-from database.models import Referral
+import time
+from typing import Dict, Any, Optional, Union, TYPE_CHECKING
+from config.settings import (
+    OZON_API_URL, OZON_HEADERS, OZON_COOKIE, OZON_REQUEST_TIMEOUT,
+    OZON_CASSETTE_MODE, OZON_CASSETTE_PATH, OZON_CASSETTE_TIMING, SUBMISSION_BODY_MAX_LENGTH
+)
+from monitoring.profiling import instrument
+from .cassette import Cassette, CassetteSession
 import logging
 
+if TYPE_CHECKING:
+    # Только для аннотаций: клиенту не нужен SQLAlchemy во время выполнения
+    from database.models import Referral
+    from database.submission_queue import PendingSubmission
+
 logger = logging.getLogger(__name__)
 
+def truncate(text: Optional[str], max_length: int) -> Optional[str]:
+    """Обрезать текст до max_length символов"""
+    if text is None or len(text) <= max_length:
+        return text
+    return text[:max_length - 1] + "…"
+
+def parse_error_code(status_code: int, text: str) -> str:
+    """Короткий код ошибки из JSON ответа Ozon, иначе HTTP_<код>"""
+    try:
+        body = json.loads(text)
+    except ValueError:
+        body = None
+
+    if isinstance(body, dict):
+        for key in ("code", "errorCode", "error", "message"):
+            value = body.get(key)
+            if isinstance(value, dict):
+                value = value.get("code") or value.get("message")
+            if isinstance(value, (str, int)) and not isinstance(value, bool) and value != "":
+                return truncate(str(value), 100)
+
+    return f"HTTP_{status_code}"
+
+def build_http_session(cassette_mode: str = OZON_CASSETTE_MODE,
+                       cassette_path: str = OZON_CASSETTE_PATH,
+                       cassette_timing: str = OZON_CASSETTE_TIMING):
+    """HTTP сессия с пулом соединений, при необходимости - с записью/воспроизведением кассеты"""
+    session = requests.Session()
+    if cassette_mode == "off":
+        return session
+
+    logger.info(f"Ozon API cassette mode: {cassette_mode} ({cassette_path})")
+    return CassetteSession(session, Cassette(cassette_path, cassette_mode, cassette_timing))
+
+@instrument
 class OzonAPIClient:
-    def __init__(self):
+    def __init__(self, session=None):
         self.base_url = OZON_API_URL
         self.headers = OZON_HEADERS.copy()
         if OZON_COOKIE:
             self.headers["Cookie"] = OZON_COOKIE
+        self.session = session or build_http_session()
 
-    def submit_referral(self, referral: Referral) -> Dict[str, Any]:
+    def submit_referral(self, referral: Union["Referral", "PendingSubmission"]) -> Dict[str, Any]:
         """
         Отправить данные реферала на Ozon API
 
         Args:
-            referral: Объект Referral с данными
+            referral: Referral или PendingSubmission с данными
 
         Returns:
             Dict с результатом отправки
@@ -43,28 +89,36 @@ class OzonAPIClient:
             })
         }
 
+        started = time.perf_counter()
         try:
             logger.info(f"Submitting referral ID {referral.id} to Ozon API")
 
-            response = requests.post(
+            response = self.session.post(
                 self.base_url,
                 headers=self.headers,
                 json=payload,
-                timeout=30
+                timeout=OZON_REQUEST_TIMEOUT
             )
 
+            # Тело ответа обрезается один раз здесь: так оно попадает и в лог, и в историю попыток
+            response_text = truncate(response.text, SUBMISSION_BODY_MAX_LENGTH)
             result = {
                 "success": response.status_code == 200,
                 "status_code": response.status_code,
-                "response_text": response.text,
+                "response_text": response_text,
+                "latency_ms": self._latency_ms(started),
+                "error_code": None,
                 "error": None
             }
 
             if result["success"]:
                 logger.info(f"Successfully submitted referral ID {referral.id}")
             else:
-                logger.error(f"Failed to submit referral ID {referral.id}: {response.status_code} - {response.text}")
-                result["error"] = f"HTTP {response.status_code}: {response.text}"
+                result["error_code"] = parse_error_code(response.status_code, response.text)
+                result["error"] = f"HTTP {response.status_code}: {result['error_code']}"
+                logger.error(
+                    f"Failed to submit referral ID {referral.id}: {response.status_code} - {response_text}"
+                )
 
             return result
 
@@ -75,6 +129,8 @@ class OzonAPIClient:
                 "success": False,
                 "status_code": None,
                 "response_text": None,
+                "latency_ms": self._latency_ms(started),
+                "error_code": type(e).__name__,
                 "error": error_msg
             }
         except Exception as e:
@@ -84,18 +140,28 @@ class OzonAPIClient:
                 "success": False,
                 "status_code": None,
                 "response_text": None,
+                "latency_ms": self._latency_ms(started),
+                "error_code": type(e).__name__,
                 "error": error_msg
             }
 
+    @staticmethod
+    def _latency_ms(started: float) -> int:
+        return int((time.perf_counter() - started) * 1000)
+
     def test_connection(self) -> bool:
-        """Тестовое подключение к API"""
+        """
+        Легкая проверка доступности API: HEAD запрос без загрузки страниц.
+        Любой HTTP ответ, кроме 5xx, означает, что сервер доступен.
+        """
         try:
-            # Пробуем GET запрос для проверки доступности
-            response = requests.get(
-                "https://recruitment.ozon.ru",
+            response = self.session.head(
+                self.base_url,
                 headers={"User-Agent": self.headers["User-Agent"]},
-                timeout=10
+                timeout=5,
+                allow_redirects=False
             )
-            return response.status_code == 200
-        except:
-            return False
\ No newline at end of file
+            return response.status_code < 500
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Ozon API is unreachable: {str(e)}")
+            return False
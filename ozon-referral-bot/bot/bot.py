@@ -1,5 +1,7 @@
 import logging
 import asyncio
+import io
+from datetime import datetime
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application,
@@ -9,21 +11,49 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from config.settings import TELEGRAM_BOT_TOKEN, CITIES, CITIZENSHIPS, DEFAULT_VACANCY_DATA
+from config.settings import (
+    TELEGRAM_BOT_TOKEN, CITIES, CITIZENSHIPS, VACANCIES, DEFAULT_VACANCY_KEY, CITY_PRIORITIES,
+    ADMIN_IDS, RUN_SCHEDULER_IN_BOT,
+    BOT_CONCURRENT_UPDATES, BOT_CONNECTION_POOL_SIZE, BOT_POOL_TIMEOUT, PROFILE_MAX_SECONDS
+)
+from database.database import session_scope, read_session_scope
 from database.referral_service import ReferralService
 from database.models import ReferralCreate
+from database.profile_cache import referrer_profiles
 from .scheduler import SubmissionScheduler
+from .notifier import NotificationQueue, SubmissionResultWatcher
+from .update_processor import PerUserUpdateProcessor
+from monitoring.profiling import instrument, sample_stacks, format_timings, reset_timings
+from monitoring.health import HealthMonitor, start_health_server
 import re
 
 # Состояния диалога
-REFERRER_NAME, REFERRER_PHONE, REFERRER_EMAIL, CANDIDATE_NAME, CANDIDATE_PHONE, CITY, CITIZENSHIP, CONFIRMATION = range(8)
+REFERRER_NAME, REFERRER_PHONE, REFERRER_EMAIL, CANDIDATE_NAME, CANDIDATE_PHONE, CITY, CITIZENSHIP, CONFIRMATION, VACANCY = range(9)
 
 logger = logging.getLogger(__name__)
 
+@instrument
 class OzonReferralBot:
     def __init__(self):
-        self.application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-        self.referral_service = ReferralService()
+        if not TELEGRAM_BOT_TOKEN:
+            raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required")
+
+        self.application = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES))
+            .connection_pool_size(BOT_CONNECTION_POOL_SIZE)
+            .pool_timeout(BOT_POOL_TIMEOUT)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        self.notifier = NotificationQueue(self.application.bot)
+        # Итоги отправки берутся из БД, поэтому уведомления работают и с отдельным worker
+        self.result_watcher = SubmissionResultWatcher(
+            self.notifier,
+            lambda limit: self._call_with_service(lambda service: service.take_unnotified_results(limit))
+        )
         self.scheduler = SubmissionScheduler()
 
         # Настраиваем обработчики
@@ -34,7 +64,10 @@ class OzonReferralBot:
 
         # Conversation handler для сбора данных реферала
         conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", self.start_referral)],
+            entry_points=[
+                CommandHandler("start", self.start_referral),
+                CommandHandler("edit_profile", self.edit_profile),
+            ],
             states={
                 REFERRER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.referrer_name)],
                 REFERRER_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.referrer_phone)],
@@ -43,6 +76,7 @@ class OzonReferralBot:
                 CANDIDATE_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.candidate_phone)],
                 CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.select_city)],
                 CITIZENSHIP: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.select_citizenship)],
+                VACANCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.select_vacancy)],
                 CONFIRMATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.confirmation)],
             },
             fallbacks=[CommandHandler("cancel", self.cancel)],
@@ -53,6 +87,31 @@ class OzonReferralBot:
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("stats", self.stats_command))
         self.application.add_handler(CommandHandler("submit_now", self.submit_now_command))
+        self.application.add_handler(CommandHandler("broadcast", self.broadcast_command))
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+
+    @staticmethod
+    def _call_with_service(func):
+        with session_scope() as db, read_session_scope() as read_db:
+            return func(ReferralService(db, read_db=read_db))
+
+    async def run_db(self, func):
+        """
+        Выполнить func(ReferralService) в пуле потоков с отдельной сессией БД,
+        чтобы синхронные запросы не блокировали обработку других пользователей.
+        Отчетные методы сервиса читают с реплики, если она настроена.
+        """
+        return await asyncio.to_thread(self._call_with_service, func)
+
+    async def post_init(self, application: Application):
+        """Запуск фоновых задач после инициализации приложения"""
+        await self.notifier.start()
+        await self.result_watcher.start()
+
+    async def post_shutdown(self, application: Application):
+        """Остановка фоновых задач при завершении приложения"""
+        await self.result_watcher.stop()
+        await self.notifier.stop()
 
     async def start_referral(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Начало диалога сбора данных реферала"""
@@ -62,14 +121,43 @@ class OzonReferralBot:
         context.user_data.clear()
         context.user_data['telegram_user_id'] = user.id
 
+        # Вернувшийся реферал не вводит свои данные повторно
+        profile = referrer_profiles.get(user.id) or await self.run_db(
+            lambda service: service.get_referrer_profile(user.id)
+        )
+        if profile:
+            context.user_data['referrer_first_name'] = profile.first_name
+            context.user_data['referrer_phone'] = profile.phone
+            context.user_data['referrer_email'] = profile.email
+
+            await update.message.reply_text(
+                f"С возвращением, {user.first_name}! 👋\n\n"
+                f"Ваши данные: {profile.first_name}, {profile.phone}, {profile.email}\n"
+                "Изменить их можно командой /edit_profile\n\n"
+                "Введите ФИО кандидата (того, кого вы рекомендуете):"
+            )
+            return CANDIDATE_NAME
+
         await update.message.reply_text(
             f"Привет, {user.first_name}! 👋\n\n"
-            "Я помогу вам отправить реферала на вакансию курьера-кладовщика в Ozon.\n\n"
+            "Я помогу вам отправить реферала на вакансию в Ozon.\n\n"
             "Пожалуйста, введите ваше ФИО (реферала):"
         )
 
         return REFERRER_NAME
 
+    async def edit_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Новая заявка с повторным вводом данных реферала"""
+        context.user_data.clear()
+        context.user_data['telegram_user_id'] = update.effective_user.id
+
+        await update.message.reply_text(
+            "Обновим ваши данные. Новые данные сохранятся вместе с этой заявкой.\n\n"
+            "Введите ваше ФИО (реферала):"
+        )
+
+        return REFERRER_NAME
+
     async def referrer_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Сбор ФИО реферала"""
         name = update.message.text.strip()
@@ -207,8 +295,43 @@ class OzonReferralBot:
         context.user_data['citizenship_name'] = citizenship_name
         context.user_data['citizenship_id'] = CITIZENSHIPS[citizenship_name]
 
-        # Показываем сводку для подтверждения
-        vacancy_data = DEFAULT_VACANCY_DATA["courier_sklad"]
+        # Если вакансия одна, выбирать нечего
+        if len(VACANCIES) == 1:
+            context.user_data['vacancy_key'] = next(iter(VACANCIES))
+            return await self.show_summary(update, context)
+
+        vacancy_keyboard = [[vacancy["title"]] for vacancy in VACANCIES.values()]
+        vacancy_keyboard.append(["Отмена"])
+
+        await update.message.reply_text(
+            "Выберите вакансию:",
+            reply_markup=ReplyKeyboardMarkup(vacancy_keyboard, one_time_keyboard=True)
+        )
+
+        return VACANCY
+
+    async def select_vacancy(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Выбор вакансии"""
+        vacancy_title = update.message.text.strip()
+
+        if vacancy_title == "Отмена":
+            await update.message.reply_text("Операция отменена.", reply_markup=ReplyKeyboardRemove())
+            return ConversationHandler.END
+
+        vacancy_key = next((key for key, vacancy in VACANCIES.items() if vacancy["title"] == vacancy_title), None)
+        if vacancy_key is None:
+            await update.message.reply_text(
+                "Пожалуйста, выберите вакансию из списка или введите 'Отмена':"
+            )
+            return VACANCY
+
+        context.user_data['vacancy_key'] = vacancy_key
+
+        return await self.show_summary(update, context)
+
+    async def show_summary(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Показать сводку для подтверждения"""
+        vacancy_data = VACANCIES[context.user_data.get('vacancy_key', DEFAULT_VACANCY_KEY)]
 
         summary = (
             "📋 Проверьте данные:\n\n"
@@ -219,7 +342,7 @@ class OzonReferralBot:
             f"📞 Телефон кандидата: {context.user_data['candidate_phone']}\n"
             f"🏙️ Город: {context.user_data['city_name']}\n"
             f"🇷🇺 Гражданство: {context.user_data['citizenship_name']}\n\n"
-            f"💼 Вакансия: Курьер-кладовщик\n\n"
+            f"💼 Вакансия: {vacancy_data['title']}\n\n"
             "✅ Все верно? Отправьте 'Да' для подтверждения или 'Нет' для отмены:"
         )
 
@@ -239,7 +362,8 @@ class OzonReferralBot:
 
         try:
             # Создаем объект с данными реферала
-            vacancy_data = DEFAULT_VACANCY_DATA["courier_sklad"]
+            vacancy_data = VACANCIES[context.user_data.get('vacancy_key', DEFAULT_VACANCY_KEY)]
+            priority = vacancy_data.get("priority", 0) + CITY_PRIORITIES.get(context.user_data['city_name'], 0)
 
             referral_data = ReferralCreate(
                 referrer_first_name=context.user_data['referrer_first_name'],
@@ -250,21 +374,24 @@ class OzonReferralBot:
                 vacancy_type=vacancy_data["combineCustomerVacancy"],
                 citizenship_id=context.user_data['citizenship_id'],
                 city_id=context.user_data['city_id'],
-                hire_object_uuid=vacancy_data["hireObjectUUID"]
+                hire_object_uuid=vacancy_data["hireObjectUUID"],
+                fullpath=vacancy_data.get("fullpath"),
+                priority=priority
             )
 
             # Сохраняем в базу данных
-            referral = self.referral_service.create_referral(
-                context.user_data['telegram_user_id'],
-                referral_data
+            telegram_user_id = context.user_data['telegram_user_id']
+            referral_id = await self.run_db(
+                lambda service: service.create_referral(telegram_user_id, referral_data).id
             )
 
-            # Попытка немедленной отправки
-            self.scheduler.submit_immediately(referral.id)
+            # Попытка немедленной отправки (иначе заявку заберет worker)
+            if RUN_SCHEDULER_IN_BOT:
+                await asyncio.to_thread(self.scheduler.submit_immediately, referral_id)
 
             await update.message.reply_text(
                 "✅ Спасибо! Данные успешно сохранены и отправлены на обработку в Ozon.\n\n"
-                f"ID вашей заявки: {referral.id}\n\n"
+                f"ID вашей заявки: {referral_id}\n\n"
                 "Вы можете отправить еще одного кандидата командой /start\n"
                 "или посмотреть статистику командой /stats"
             )
@@ -290,17 +417,18 @@ class OzonReferralBot:
         help_text = (
             "🤖 Бот для рефералов Ozon\n\n"
             "📝 /start - Начать процесс реферала\n"
+            "✏️ /edit_profile - Изменить свои данные и отправить кандидата\n"
             "📊 /stats - Посмотреть статистику\n"
             "🚀 /submit_now - Принудительно отправить ожидающие заявки\n"
             "❓ /help - Показать эту справку\n\n"
-            "Бот автоматически отправляет данные на серверы Ozon каждые 5 минут."
+            "Бот автоматически отправляет данные на серверы Ozon, как только они появляются."
         )
         await update.message.reply_text(help_text)
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать статистику"""
         try:
-            stats = self.referral_service.get_submission_stats()
+            stats = await self.run_db(lambda service: service.get_submission_stats())
 
             stats_text = (
                 "📊 Статистика рефералов:\n\n"
@@ -310,6 +438,35 @@ class OzonReferralBot:
                 f"❌ Ошибки отправки: {stats['failed']}\n"
             )
 
+            # Администраторам показываем состояние процесса: очередь уведомлений, кэш профилей и решения планировщика
+            if update.effective_user.id in ADMIN_IDS:
+                stats_text += f"\n📨 Очередь уведомлений: {self.notifier.pending_count()} чатов\n"
+                cache = referrer_profiles.stats()
+                stats_text += (
+                    f"👤 Кэш профилей: {cache['size']} записей, "
+                    f"попаданий {cache['hits']}, промахов {cache['misses']}\n"
+                )
+
+                if RUN_SCHEDULER_IN_BOT:
+                    state = self.scheduler.get_state()
+                    last = state["last_decision"]
+                    stats_text += (
+                        f"⚙️ Пауза между запросами: {state['request_delay']:.2f} с (пачка {state['batch_size']})\n"
+                        f"💤 Пауза при пустой очереди: {state['idle_seconds']:.0f} с\n"
+                    )
+                    if last:
+                        # У решения idle (пустая очередь) задержки нет
+                        latency = last['avg_latency_ms']
+                        latency_text = f", задержка {latency} мс" if latency is not None else ""
+                        stats_text += (
+                            f"🧭 Последнее решение: {last['decision']} "
+                            f"(обработано {last['processed']}, ошибок {last['failed']}{latency_text})\n"
+                        )
+                    # Решения по порядку, последнее справа: видно, как темп менялся недавно
+                    recent = self.scheduler.controller.recent_decisions()[-10:]
+                    if len(recent) > 1:
+                        stats_text += "🕘 Недавние решения: " + " → ".join(d["decision"] for d in recent) + "\n"
+
             await update.message.reply_text(stats_text)
 
         except Exception as e:
@@ -321,7 +478,7 @@ class OzonReferralBot:
         try:
             await update.message.reply_text("🚀 Запускаю отправку ожидающих заявок...")
 
-            self.scheduler.submit_immediately()
+            await asyncio.to_thread(self.scheduler.submit_immediately)
 
             await update.message.reply_text("✅ Отправка завершена!")
 
@@ -329,12 +486,74 @@ class OzonReferralBot:
             logger.error(f"Error in manual submission: {str(e)}")
             await update.message.reply_text("❌ Ошибка при отправке заявок")
 
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Рассылка сообщения всем пользователям (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("⛔ Команда доступна только администраторам")
+            return
+
+        text = " ".join(context.args).strip()
+        if not text:
+            await update.message.reply_text("Использование: /broadcast <текст сообщения>")
+            return
+
+        try:
+            user_ids = await self.run_db(lambda service: service.get_user_ids())
+            count = self.notifier.broadcast(user_ids, text)
+            await update.message.reply_text(f"📨 Рассылка поставлена в очередь: {count} получателей")
+
+        except Exception as e:
+            logger.error(f"Error in broadcast: {str(e)}")
+            await update.message.reply_text("❌ Ошибка при запуске рассылки")
+
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Профилирование живого процесса (только для администраторов)"""
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("⛔ Команда доступна только администраторам")
+            return
+
+        if context.args and context.args[0] == "reset":
+            # Начать замеры с чистого листа, например перед воспроизведением проблемы
+            reset_timings()
+            await update.message.reply_text("🧹 Тайминги сброшены")
+            return
+
+        try:
+            seconds = int(context.args[0]) if context.args else 10
+        except ValueError:
+            await update.message.reply_text("Использование: /profile <секунды> или /profile reset")
+            return
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+        try:
+            await update.message.reply_text(f"⏱ Профилирую процесс {seconds} с...")
+            folded = await asyncio.to_thread(sample_stacks, seconds)
+
+            filename = f"profile-{datetime.utcnow():%Y%m%d-%H%M%S}.folded"
+            await update.message.reply_document(
+                document=io.BytesIO(folded.encode("utf-8")),
+                filename=filename,
+                caption="Свернутые стеки для flamegraph.pl или speedscope.app"
+            )
+            # Лимит Telegram на длину сообщения - 4096 символов
+            await update.message.reply_text(f"📈 Тайминги:\n{format_timings()}"[:4096])
+
+        except RuntimeError as e:
+            await update.message.reply_text(f"❌ {e}")
+        except Exception as e:
+            logger.error(f"Error in profiling: {str(e)}")
+            await update.message.reply_text("❌ Ошибка при профилировании")
+
     def run(self):
         """Запуск бота"""
         logger.info("Starting Ozon Referral Bot...")
 
-        # Запускаем планировщик в фоне
-        self.scheduler.start()
+        # Запускаем планировщик в фоне (если отправкой не занимается отдельный worker)
+        if RUN_SCHEDULER_IN_BOT:
+            self.scheduler.start()
+
+        # HTTP проверки здоровья для оркестратора
+        start_health_server(HealthMonitor(ozon_client=self.scheduler.ozon_client))
 
         # Запускаем бота
         self.application.run_polling()
\ No newline at end of file
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+from config.settings import (
+    NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_INTERVAL, NOTIFY_MAX_RETRIES, NOTIFY_POLL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей рассылки ставить в очередь за один шаг цикла событий
+BROADCAST_CHUNK_SIZE = 500
+# Сколько итогов отправки забирать из БД за один запрос
+RESULTS_BATCH_SIZE = 100
+
+
+class NotificationQueue:
+    """
+    Очередь исходящих сообщений поверх PTB Application.
+
+    Соблюдает глобальный лимит Telegram (сообщений в секунду на бота) и
+    лимит на один чат, склеивает несколько статусов по одному пользователю
+    в одно сообщение и повторяет отправку после RetryAfter.
+
+    Методы notify_status/send/broadcast потокобезопасны: их можно вызывать
+    как из обработчиков, так и из потока планировщика.
+    """
+
+    def __init__(self, bot, global_rate: float = NOTIFY_GLOBAL_RATE,
+                 per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL,
+                 max_retries: int = NOTIFY_MAX_RETRIES):
+        self.bot = bot
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+
+        # Статусы по рефералам: chat_id -> {referral_id: текст}, склеиваются в одно сообщение
+        self._statuses: Dict[int, "OrderedDict[int, str]"] = {}
+        # Обычные сообщения (рассылки): chat_id -> очередь текстов
+        self._messages: Dict[int, Deque[str]] = {}
+        # Чаты, у которых есть что отправить, в порядке поступления (OrderedDict - проверка за O(1))
+        self._ready: "OrderedDict[int, None]" = OrderedDict()
+        self._next_chat_send: Dict[int, float] = {}
+        self._attempts: Dict[int, int] = {}
+        self._next_global_send = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._broadcast_tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Запустить фоновую отправку (вызывается из post_init приложения)"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Notification queue started")
+
+    async def stop(self):
+        """Остановить фоновую отправку"""
+        for task in list(self._broadcast_tasks):
+            task.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pending = sum(len(s) for s in self._statuses.values()) + sum(len(m) for m in self._messages.values())
+        if pending:
+            logger.warning(f"Notification queue stopped with {pending} undelivered messages")
+        logger.info("Notification queue stopped")
+
+    def notify_status(self, chat_id: int, referral_id: int, text: str):
+        """Поставить в очередь статус по заявке (последний статус по заявке заменяет предыдущий)"""
+        self._call_in_loop(self._enqueue_status, chat_id, referral_id, text)
+
+    def send(self, chat_id: int, text: str):
+        """Поставить в очередь обычное сообщение"""
+        self._call_in_loop(self._enqueue_message, chat_id, text)
+
+    def broadcast(self, chat_ids: Iterable[int], text: str) -> int:
+        """
+        Поставить в очередь рассылку, вернуть количество получателей.
+        Получатели добавляются порциями, чтобы большая рассылка не блокировала обработчики.
+        """
+        chat_ids = list(chat_ids)
+        self._call_in_loop(self._start_broadcast, chat_ids, text)
+        return len(chat_ids)
+
+    def pending_count(self) -> int:
+        """Количество чатов, ожидающих отправки"""
+        return len(self._ready)
+
+    def _call_in_loop(self, func, *args):
+        if self._loop is None:
+            logger.warning("Notification queue is not started, message dropped")
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _enqueue_status(self, chat_id: int, referral_id: int, text: str):
+        statuses = self._statuses.setdefault(chat_id, OrderedDict())
+        statuses.pop(referral_id, None)
+        statuses[referral_id] = text
+        self._mark_ready(chat_id)
+
+    def _enqueue_message(self, chat_id: int, text: str):
+        self._messages.setdefault(chat_id, deque()).append(text)
+        self._mark_ready(chat_id)
+
+    def _start_broadcast(self, chat_ids: List[int], text: str):
+        task = self._loop.create_task(self._enqueue_broadcast(chat_ids, text))
+        self._broadcast_tasks.add(task)
+        task.add_done_callback(self._broadcast_tasks.discard)
+
+    async def _enqueue_broadcast(self, chat_ids: List[int], text: str):
+        for start in range(0, len(chat_ids), BROADCAST_CHUNK_SIZE):
+            for chat_id in chat_ids[start:start + BROADCAST_CHUNK_SIZE]:
+                self._enqueue_message(chat_id, text)
+            # Отдаем управление обработчикам между порциями
+            await asyncio.sleep(0)
+
+    def _mark_ready(self, chat_id: int):
+        if chat_id not in self._ready:
+            self._ready[chat_id] = None
+        self._wakeup.set()
+
+    def _pick_chat(self, now: float) -> Optional[int]:
+        """Первый в очереди чат, для которого истек лимит на чат"""
+        for chat_id in self._ready:
+            if self._next_chat_send.get(chat_id, 0.0) <= now:
+                return chat_id
+        return None
+
+    def _take_text(self, chat_id: int):
+        """Текст следующего сообщения и снимок склеенных статусов (None для обычного сообщения)"""
+        statuses = self._statuses.get(chat_id)
+        if statuses:
+            return "\n\n".join(statuses.values()), dict(statuses)
+        messages = self._messages.get(chat_id)
+        if messages:
+            return messages[0], None
+        return None, None
+
+    def _complete(self, chat_id: int, sent_statuses: Optional[Dict[int, str]]):
+        """Убрать отправленное сообщение из очереди чата"""
+        self._attempts.pop(chat_id, None)
+        if sent_statuses is not None:
+            # Статусы, пришедшие во время отправки, остаются в очереди
+            statuses = self._statuses.get(chat_id, {})
+            for referral_id, text in sent_statuses.items():
+                if statuses.get(referral_id) == text:
+                    del statuses[referral_id]
+            if not statuses:
+                self._statuses.pop(chat_id, None)
+        else:
+            messages = self._messages.get(chat_id)
+            if messages:
+                messages.popleft()
+                if not messages:
+                    del self._messages[chat_id]
+        self._ready.pop(chat_id, None)
+        if chat_id in self._statuses or chat_id in self._messages:
+            self._ready[chat_id] = None
+
+    def _drop_chat(self, chat_id: int):
+        self._statuses.pop(chat_id, None)
+        self._messages.pop(chat_id, None)
+        self._attempts.pop(chat_id, None)
+        self._ready.pop(chat_id, None)
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                # Очередь пуста - забываем истекшие лимиты на чаты
+                now = time.monotonic()
+                self._next_chat_send = {c: t for c, t in self._next_chat_send.items() if t > now}
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            chat_id = self._pick_chat(now)
+            if chat_id is None:
+                # Все чаты упираются в лимит на чат - ждем ближайший или новое сообщение
+                delay = min(self._next_chat_send.get(c, 0.0) for c in self._ready) - now
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._next_global_send > now:
+                await asyncio.sleep(self._next_global_send - now)
+
+            text, sent_statuses = self._take_text(chat_id)
+            if text is None:
+                self._ready.pop(chat_id, None)
+                continue
+
+            await self._send(chat_id, text, sent_statuses)
+
+    async def _send(self, chat_id: int, text: str, sent_statuses: Optional[Dict[int, str]]):
+        now = time.monotonic()
+        self._next_global_send = now + self.global_interval
+        self._next_chat_send[chat_id] = now + self.per_chat_interval
+
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+            self._complete(chat_id, sent_statuses)
+        except RetryAfter as e:
+            # Флуд-контроль: приостанавливаем всю очередь, сообщение остается первым
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            logger.warning(f"Telegram flood control, pausing notifications for {retry_after}s")
+            self._next_global_send = time.monotonic() + retry_after
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен - повторять бессмысленно
+            logger.info(f"Dropping notifications for chat {chat_id}: {e}")
+            self._drop_chat(chat_id)
+        except TelegramError as e:
+            attempts = self._attempts.get(chat_id, 0) + 1
+            if attempts >= self.max_retries:
+                logger.error(f"Giving up on notification to chat {chat_id} after {attempts} attempts: {e}")
+                self._complete(chat_id, sent_statuses)
+            else:
+                self._attempts[chat_id] = attempts
+                self._next_chat_send[chat_id] = time.monotonic() + self.per_chat_interval * (2 ** attempts)
+                logger.warning(f"Notification to chat {chat_id} failed (attempt {attempts}): {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error sending notification to chat {chat_id}: {str(e)}")
+            self._complete(chat_id, sent_statuses)
+
+
+class SubmissionResultWatcher:
+    """
+    Уведомления об итогах отправки независимо от того, какой процесс отправил заявку.
+
+    Периодически забирает из БД итоги, о которых пользователь еще не знает
+    (ReferralService.take_unnotified_results), и ставит их в NotificationQueue.
+    Так уведомления приходят и при отправке отдельным worker.
+    """
+
+    def __init__(self, notifier: NotificationQueue, take_results: Callable[[int], List],
+                 interval: float = NOTIFY_POLL_SECONDS):
+        self.notifier = notifier
+        # Синхронная функция (limit) -> строки итогов, выполняется в пуле потоков
+        self.take_results = take_results
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Submission result watcher started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def format_result(result) -> str:
+        if result.submitted_to_ozon:
+            return f"✅ Заявка #{result.id} ({result.candidate_full_name}) принята Ozon."
+        return (
+            f"❌ Заявку #{result.id} ({result.candidate_full_name}) не удалось отправить в Ozon "
+            f"после {result.submission_attempts} попыток."
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                results = await asyncio.to_thread(self.take_results, RESULTS_BATCH_SIZE)
+            except Exception as e:
+                logger.error(f"Error fetching submission results: {str(e)}")
+                results = []
+
+            for result in results:
+                self.notifier.notify_status(result.telegram_user_id, result.id, self.format_result(result))
+
+            # Полная порция - вероятно, есть еще итоги, забираем сразу
+            if len(results) < RESULTS_BATCH_SIZE:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+from config.settings import (
+    SUBMIT_BATCH_SIZE, SUBMIT_REQUEST_DELAY, SUBMIT_MIN_REQUEST_DELAY, SUBMIT_MAX_REQUEST_DELAY,
+    SUBMIT_RATE_STEP, SUBMIT_TARGET_LATENCY_MS, SUBMIT_MAX_ERROR_RATE,
+    SUBMIT_IDLE_MIN_SECONDS, SUBMIT_INTERVAL_MINUTES
+)
+
+logger = logging.getLogger(__name__)
+
+# Пауза между запросами не бывает нулевой: темп должен оставаться конечным, чтобы его можно было уменьшать вдвое
+MIN_REQUEST_DELAY_FLOOR = 0.001
+
+
+class AdaptiveRateController:
+    """
+    Темп отправки (запросов в секунду) и паузы цикла отправки по принципу AIMD.
+
+    Запросы к Ozon идут последовательно, поэтому пропускную способность определяет
+    пауза между ними, а не размер пачки. Пачка остается небольшой (SUBMIT_BATCH_SIZE),
+    чтобы закрепления были короткими, а новые приоритетные заявки не ждали длинную пачку.
+
+    - Полная пачка прошла без ошибок и с нормальной задержкой Ozon - темп растет на SUBMIT_RATE_STEP.
+    - Доля ошибок или средняя задержка выше порога - темп уменьшается вдвое.
+    - Пауза между запросами остается в пределах SUBMIT_MIN_REQUEST_DELAY..SUBMIT_MAX_REQUEST_DELAY.
+    - Очередь пуста - пауза удваивается от SUBMIT_IDLE_MIN_SECONDS до SUBMIT_INTERVAL_MINUTES.
+    """
+
+    def __init__(self, batch_size: int = SUBMIT_BATCH_SIZE,
+                 request_delay: float = SUBMIT_REQUEST_DELAY,
+                 min_request_delay: float = SUBMIT_MIN_REQUEST_DELAY,
+                 max_request_delay: float = SUBMIT_MAX_REQUEST_DELAY,
+                 rate_step: float = SUBMIT_RATE_STEP,
+                 target_latency_ms: float = SUBMIT_TARGET_LATENCY_MS,
+                 max_error_rate: float = SUBMIT_MAX_ERROR_RATE,
+                 idle_min_seconds: float = SUBMIT_IDLE_MIN_SECONDS,
+                 idle_max_seconds: float = SUBMIT_INTERVAL_MINUTES * 60):
+        self.batch_size = max(1, batch_size)
+        min_request_delay = max(MIN_REQUEST_DELAY_FLOOR, min_request_delay)
+        max_request_delay = max(min_request_delay, max_request_delay)
+        self.max_rate = 1 / min_request_delay
+        self.min_rate = 1 / max_request_delay
+        self.rate = min(max(1 / max(request_delay, MIN_REQUEST_DELAY_FLOOR), self.min_rate), self.max_rate)
+        self.rate_step = rate_step
+        self.target_latency_ms = target_latency_ms
+        self.max_error_rate = max_error_rate
+        self.idle_min_seconds = idle_min_seconds
+        self.idle_max_seconds = max(idle_min_seconds, idle_max_seconds)
+        self.idle_seconds = idle_min_seconds
+
+        self._lock = threading.Lock()
+        self._decisions: deque = deque(maxlen=20)
+        self._last_decision: Dict = {}
+
+    @property
+    def request_delay(self) -> float:
+        """Текущая пауза между запросами к Ozon, секунд"""
+        return 1 / self.rate
+
+    def record_batch(self, processed: int, failed: int, latency_ms: int, requested: int = None) -> float:
+        """
+        Учесть результат пачки и вернуть паузу перед следующей, секунд.
+        requested - сколько заявок запрашивалось (по умолчанию batch_size).
+        """
+        with self._lock:
+            requested = requested or self.batch_size
+            previous_rate = self.rate
+
+            if processed == 0:
+                wait = self.idle_seconds
+                self.idle_seconds = min(self.idle_seconds * 2, self.idle_max_seconds)
+                decision = "idle"
+                error_rate = avg_latency_ms = None
+            else:
+                self.idle_seconds = self.idle_min_seconds
+                error_rate = failed / processed
+                avg_latency_ms = latency_ms / processed
+
+                if error_rate > self.max_error_rate or avg_latency_ms > self.target_latency_ms:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    decision = "decrease"
+                    wait = self.request_delay
+                elif processed >= requested:
+                    # Пачка заполнена целиком - очередь не пуста, можно отправлять чаще
+                    self.rate = min(self.max_rate, self.rate + self.rate_step)
+                    decision = "increase"
+                    wait = self.request_delay
+                else:
+                    # Очередь разобрана - проверим ее снова после минимальной паузы
+                    decision = "hold"
+                    wait = self.idle_min_seconds
+
+            self._last_decision = {
+                "at": time.time(),
+                "decision": decision,
+                "processed": processed,
+                "failed": failed,
+                "error_rate": round(error_rate, 3) if error_rate is not None else None,
+                "avg_latency_ms": int(avg_latency_ms) if avg_latency_ms is not None else None,
+                "request_delay": round(self.request_delay, 3),
+                "wait_seconds": wait
+            }
+            self._decisions.append(self._last_decision)
+
+        if decision in ("increase", "decrease") and self.rate != previous_rate:
+            logger.info(
+                f"Adaptive scheduler: {decision} rate {previous_rate:.2f} -> {self.rate:.2f} req/s "
+                f"(error rate {error_rate:.0%}, avg latency {avg_latency_ms:.0f} ms)"
+            )
+        return wait
+
+    def snapshot(self) -> Dict:
+        """Текущее состояние и последнее решение для мониторинга"""
+        with self._lock:
+            return {
+                "batch_size": self.batch_size,
+                "request_delay": round(self.request_delay, 3),
+                "idle_seconds": self.idle_seconds,
+                "last_decision": dict(self._last_decision)
+            }
+
+    def recent_decisions(self) -> List[Dict]:
+        """Последние решения контроллера"""
+        with self._lock:
+            return list(self._decisions)
@@ -1,94 +1,165 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from database.referral_service import ReferralService
+from database.database import session_scope
+from database.submission_queue import SubmissionQueue
 from api.ozon_client import OzonAPIClient
-from config.settings import SUBMIT_INTERVAL_MINUTES
+from monitoring.health import heartbeat
+from config.settings import CLAIM_LEASE_SECONDS, OZON_REQUEST_TIMEOUT
+from .rate_controller import AdaptiveRateController
 import logging
+import threading
 import time
+from typing import Dict
 
 logger = logging.getLogger(__name__)
 
 class SubmissionScheduler:
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
-        self.referral_service = ReferralService()
+        self.controller = AdaptiveRateController()
         self.ozon_client = OzonAPIClient()
-
-    def submit_pending_referrals(self):
-        """Отправить ожидающие рефералы на Ozon"""
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def submit_pending_referrals(self, stop_event=None, limit: int = None) -> Dict[str, int]:
+        """
+        Отправить пачку ожидающих рефералов на Ozon.
+        Возвращает {"requested", "processed", "failed", "latency_ms"} для адаптивного планировщика.
+
+        Если установлен stop_event, отправка прерывается после текущей заявки,
+        а оставшиеся закрепленные заявки возвращаются в очередь.
+        """
+        request_delay = self.controller.request_delay
+        # Пачка должна успеть отправиться за время закрепления даже при таймаутах каждого запроса
+        max_batch = max(1, int(CLAIM_LEASE_SECONDS // (OZON_REQUEST_TIMEOUT + request_delay)))
+        limit = min(limit or self.controller.batch_size, max_batch)
+        stats = {"requested": limit, "processed": 0, "failed": 0, "latency_ms": 0}
         try:
-            logger.info("Starting scheduled submission of pending referrals")
-
-            pending_referrals = self.referral_service.get_pending_submissions(limit=10)
-
-            if not pending_referrals:
-                logger.info("No pending referrals to submit")
-                return
-
-            logger.info(f"Found {len(pending_referrals)} pending referrals to submit")
-
-            for referral in pending_referrals:
-                try:
-                    result = self.ozon_client.submit_referral(referral)
-
-                    success = result["success"]
-                    error = result.get("error")
-
-                    self.referral_service.update_submission_status(
-                        referral.id,
-                        success=success,
-                        error=error
-                    )
-
-                    # Небольшая пауза между запросами
-                    await asyncio.sleep(1)
-
-                except Exception as e:
-                    logger.error(f"Error submitting referral ID {referral.id}: {str(e)}")
-                    self.referral_service.update_submission_status(
-                        referral.id,
-                        success=False,
-                        error=str(e)
-                    )
+            logger.debug("Starting submission of pending referrals")
+
+            # Своя сессия на каждую пачку: планировщик и обработчики бота работают в разных потоках.
+            # Заявки приходят компактными PendingSubmission, без моделей и identity map.
+            with session_scope() as db:
+                queue = SubmissionQueue(db)
+                pending_referrals = queue.claim_batch(
+                    limit=limit,
+                    lease_seconds=CLAIM_LEASE_SECONDS
+                )
+
+                if not pending_referrals:
+                    logger.debug("No pending referrals to submit")
+                    return stats
+
+                logger.info(f"Found {len(pending_referrals)} pending referrals to submit")
+
+                for index, referral in enumerate(pending_referrals):
+                    if stop_event is not None and stop_event.is_set():
+                        queue.release([r.id for r in pending_referrals[index:]])
+                        break
+
+                    # Закрепление продлевается перед каждой отправкой: если оно истекло
+                    # и заявку забрал другой процесс, она не отправляется второй раз
+                    if not queue.renew(referral, CLAIM_LEASE_SECONDS):
+                        continue
+
+                    try:
+                        result = self.ozon_client.submit_referral(referral)
+
+                        success = result["success"]
+                        error = result.get("error")
+
+                        queue.record_result(
+                            referral,
+                            success=success,
+                            error=error,
+                            attempt=result
+                        )
+                        stats["latency_ms"] += result.get("latency_ms") or 0
+
+                    except Exception as e:
+                        logger.error(f"Error submitting referral ID {referral.id}: {str(e)}")
+                        db.rollback()
+                        queue.record_result(
+                            referral,
+                            success=False,
+                            error=str(e),
+                            attempt={"error_code": type(e).__name__}
+                        )
+                        success = False
+
+                    stats["processed"] += 1
+                    if not success:
+                        stats["failed"] += 1
+
+                    # Пауза между запросами задает темп отправки (подбирает AdaptiveRateController)
+                    if index < len(pending_referrals) - 1:
+                        if stop_event is not None:
+                            stop_event.wait(request_delay)
+                        else:
+                            time.sleep(request_delay)
 
         except Exception as e:
             logger.error(f"Error in scheduled submission: {str(e)}")
 
-    def start(self):
-        """Запустить планировщик"""
-        # Добавляем задачу на отправку каждые N минут
-        self.scheduler.add_job(
-            self.submit_pending_referrals,
-            trigger=IntervalTrigger(minutes=SUBMIT_INTERVAL_MINUTES),
-            id="submit_referrals",
-            name="Submit pending referrals to Ozon"
+        return stats
+
+    def run_forever(self, stop_event: threading.Event):
+        """
+        Адаптивный цикл отправки: пока есть очередь - разбирает ее небольшими пачками
+        в темпе, который подбирает контроллер, пустую очередь опрашивает с нарастающей паузой.
+        """
+        logger.info(
+            f"Starting adaptive submission loop (batch size {self.controller.batch_size}, "
+            f"initial request delay {self.controller.request_delay:.2f} s)"
         )
+        while not stop_event.is_set():
+            stats = self.submit_pending_referrals(stop_event=stop_event)
+            wait = self.controller.record_batch(
+                stats["processed"], stats["failed"], stats["latency_ms"], requested=stats["requested"]
+            )
+            heartbeat("scheduler", self.controller.snapshot())
+            if wait:
+                stop_event.wait(wait)
+        logger.info("Adaptive submission loop stopped")
 
-        logger.info(f"Starting scheduler with {SUBMIT_INTERVAL_MINUTES} minute intervals")
-        self.scheduler.start()
+    def start(self):
+        """Запустить планировщик в фоновом потоке"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever,
+            args=(self._stop_event,),
+            name="submission-scheduler",
+            daemon=True
+        )
+        self._thread.start()
 
     def stop(self):
         """Остановить планировщик"""
-        if self.scheduler.running:
-            self.scheduler.shutdown()
+        if self._thread and self._thread.is_alive():
+            self._stop_event.set()
+            self._thread.join()
             logger.info("Scheduler stopped")
 
+    def get_state(self) -> Dict:
+        """Состояние адаптивного планировщика для мониторинга"""
+        return self.controller.snapshot()
+
     def submit_immediately(self, referral_id: int = None):
         """Отправить реферал немедленно (по запросу)"""
         if referral_id:
             # Отправить конкретный реферал
-            referral = self.referral_service.get_referral_by_id(referral_id)
-            if not referral:
-                logger.error(f"Referral ID {referral_id} not found")
-                return False
-
-            result = self.ozon_client.submit_referral(referral)
-            self.referral_service.update_submission_status(
-                referral.id,
-                success=result["success"],
-                error=result.get("error")
-            )
-            return result["success"]
+            with session_scope() as db:
+                queue = SubmissionQueue(db)
+                referral = queue.claim_one(referral_id, lease_seconds=CLAIM_LEASE_SECONDS)
+                if not referral:
+                    logger.warning(f"Referral ID {referral_id} not found, already submitted or claimed by another worker")
+                    return False
+
+                result = self.ozon_client.submit_referral(referral)
+                queue.record_result(
+                    referral,
+                    success=result["success"],
+                    error=result.get("error"),
+                    attempt=result
+                )
+                return result["success"]
         else:
             # Отправить все ожидающие
             self.submit_pending_referrals()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import sys
+from typing import Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не более
+    max_concurrent_updates), а обновления одного пользователя - строго по очереди,
+    чтобы ConversationHandler видел сообщения в том порядке, в котором они пришли.
+
+    Слот параллельности занимает только первое обновление в очереди пользователя:
+    остальные ждут на его блокировке и не отнимают слоты у других пользователей.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Базовый класс берет свой семафор до do_process_update, то есть до блокировки
+        # пользователя - тогда ожидающие обновления одного пользователя заняли бы все слоты.
+        # Его заменяет неограниченный, а лимит соблюдается внутри блокировки пользователя.
+        self._semaphore = asyncio.BoundedSemaphore(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        """Ключ, по которому сериализуются обновления: пользователь, иначе чат"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            # Удаляем блокировку, когда у пользователя не осталось ожидающих обновлений
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._locks:
+            logger.warning(f"Update processor shut down with {len(self._locks)} users still in progress")
@@ -0,0 +1,125 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import Callable, Dict, Optional
+from config.settings import WORKER_PROCESSES, WORKER_SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker_process(index: int, setup_logging: Optional[Callable] = None,
+                       heartbeats: Optional[multiprocessing.Queue] = None):
+    """
+    Точка входа одного процесса отправки.
+
+    Процесс запускается через spawn, поэтому модули БД и клиента Ozon
+    импортируются заново: у каждого процесса свой пул соединений к БД,
+    своя HTTP сессия и свой цикл отправки. Отметки heartbeat планировщика
+    уходят в очередь heartbeats родительскому процессу.
+    """
+    if setup_logging:
+        setup_logging()
+
+    if heartbeats is not None:
+        from monitoring.health import set_heartbeat_sink
+        # Последние отметки при выходе не важны - не ждем, пока родитель их вычитает
+        heartbeats.cancel_join_thread()
+        set_heartbeat_sink(
+            lambda name, at, state: heartbeats.put_nowait((f"worker_{index}_{name}", at, state))
+        )
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Worker {index} received signal {signum}, draining current submission")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    from bot.scheduler import SubmissionScheduler
+    scheduler = SubmissionScheduler()
+
+    logger.info(f"Submission worker {index} started")
+    scheduler.run_forever(stop_event)
+    logger.info(f"Submission worker {index} stopped")
+
+
+class WorkerPool:
+    """Родительский процесс: запускает процессы отправки, перезапускает упавшие и останавливает их по SIGTERM"""
+
+    def __init__(self, processes: int = WORKER_PROCESSES, setup_logging: Optional[Callable] = None):
+        self.processes = max(1, processes)
+        self.setup_logging = setup_logging
+        self.context = multiprocessing.get_context("spawn")
+        self.workers: Dict[int, multiprocessing.Process] = {}
+        # Отметки heartbeat процессов отправки для /readyz родителя
+        self.heartbeats = self.context.Queue()
+        self.stopping = False
+
+    def _spawn(self, index: int):
+        process = self.context.Process(
+            target=run_worker_process,
+            args=(index, self.setup_logging, self.heartbeats),
+            name=f"submission-worker-{index}"
+        )
+        process.start()
+        self.workers[index] = process
+        logger.info(f"Started submission worker {index} (pid {process.pid})")
+
+    def _collect_heartbeats(self):
+        """Перенести отметки процессов отправки в heartbeat родителя"""
+        from monitoring.health import heartbeat
+        while True:
+            try:
+                name, at, state = self.heartbeats.get_nowait()
+            except queue.Empty:
+                return
+            heartbeat(name, state, at=at)
+
+    def _request_stop(self, signum, frame):
+        logger.info(f"Received signal {signum}, stopping submission workers")
+        self.stopping = True
+
+    def run(self):
+        """Запустить процессы и ждать сигнала остановки"""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        # На проверки здоровья отвечает родительский процесс: отставание очереди видно по БД,
+        # состояние планировщиков - по отметкам, которые процессы присылают через очередь
+        from api.ozon_client import OzonAPIClient
+        from monitoring.health import HealthMonitor, start_health_server
+        start_health_server(HealthMonitor(ozon_client=OzonAPIClient()))
+
+        for index in range(self.processes):
+            self._spawn(index)
+
+        while not self.stopping:
+            self._collect_heartbeats()
+            for index, process in list(self.workers.items()):
+                if not process.is_alive() and not self.stopping:
+                    logger.error(f"Submission worker {index} exited with code {process.exitcode}, restarting")
+                    self._spawn(index)
+            time.sleep(1)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Мягкая остановка: процессы дорабатывают текущую заявку и возвращают остальные в очередь"""
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        for index, process in self.workers.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Submission worker {index} did not stop in time, killing")
+                process.kill()
+                process.join()
+
+        logger.info("All submission workers stopped")
@@ -1,23 +1,126 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import (
+    create_engine, select, func, inspect, text, or_, update,
+    MetaData, Table, Column, Integer, String, DateTime, Boolean, Text
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError, SQLAlchemyError
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
-from config.settings import DATABASE_URL
-from .models import Base
+from config.settings import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, MAX_SUBMISSION_ATTEMPTS,
+    DATABASE_REPLICA_URLS, REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS
+)
+from .models import Base, Referral, SchemaVersion, SCHEMA_VERSION
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+def _engine_options(url: str) -> dict:
+    """Параметры пула соединений в зависимости от СУБД"""
+    if url.startswith("sqlite"):
+        # SQLite: разрешаем использовать соединение из потоков обработчиков и планировщика
+        return {"connect_args": {"check_same_thread": False}}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+
 # Создаем engine для PostgreSQL
 engine = create_engine(
     DATABASE_URL,
-    poolclass=StaticPool,
     pool_pre_ping=True,
-    echo=False  # Установите True для отладки SQL запросов
+    echo=False,  # Установите True для отладки SQL запросов
+    **_engine_options(DATABASE_URL)
 )
 
+# Реплики только для чтения (отчеты, статистика, история пользователя)
+replica_engines = [
+    create_engine(url, pool_pre_ping=True, echo=False, **_engine_options(url))
+    for url in DATABASE_REPLICA_URLS
+]
+
 # Создаем SessionLocal класс
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Отставание реплики PostgreSQL в секундах; 0, если реплика догнала primary или это не реплика
+_PG_REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+    "THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class ReplicaRouter:
+    """
+    Выбор движка для чтения: реплики по кругу, если их отставание не больше
+    max_lag секунд, иначе primary. Отставание проверяется не чаще раза в check_interval секунд.
+    """
+
+    def __init__(self, primary: Engine, replicas: List[Engine],
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS, check_interval: float = REPLICA_CHECK_SECONDS):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._counter = count()
+        self._lock = threading.Lock()
+        # движок -> (время проверки, отставание или None, если реплика недоступна)
+        self._lag_cache: Dict[Engine, Tuple[float, Optional[float]]] = {}
+
+    def _measure_lag(self, replica: Engine) -> Optional[float]:
+        try:
+            with replica.connect() as conn:
+                if replica.dialect.name == "postgresql":
+                    return float(conn.execute(_PG_REPLICA_LAG_SQL).scalar() or 0)
+                conn.execute(text("SELECT 1"))
+                return 0.0
+        except SQLAlchemyError as e:
+            logger.warning(f"Read replica {replica.url.render_as_string(hide_password=True)} is unavailable: {e}")
+            return None
+
+    def replica_lag(self, replica: Engine) -> Optional[float]:
+        """Отставание реплики (кэшируется), None - реплика недоступна"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._lag_cache.get(replica)
+        if cached and now - cached[0] < self.check_interval:
+            return cached[1]
+
+        lag = self._measure_lag(replica)
+        with self._lock:
+            self._lag_cache[replica] = (now, lag)
+        return lag
+
+    def is_usable(self, replica: Engine) -> bool:
+        lag = self.replica_lag(replica)
+        return lag is not None and lag <= self.max_lag
+
+    def pick(self) -> Engine:
+        """Движок для следующей читающей сессии"""
+        if not self.replicas:
+            return self.primary
+
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if self.is_usable(replica):
+                return replica
+
+        logger.warning("No read replica within allowed lag, reading from primary")
+        return self.primary
+
+    def status(self) -> List[Dict]:
+        """Состояние реплик для мониторинга"""
+        return [
+            {
+                "url": replica.url.render_as_string(hide_password=True),
+                "lag_seconds": self.replica_lag(replica),
+                "usable": self.is_usable(replica)
+            }
+            for replica in self.replicas
+        ]
+
+read_router = ReplicaRouter(engine, replica_engines)
+
 def get_db() -> Session:
     """Получить сессию базы данных"""
     db = SessionLocal()
@@ -26,6 +129,28 @@ def get_db() -> Session:
     finally:
         db.close()
 
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Короткоживущая сессия на одну операцию: откат при ошибке, закрытие по выходу"""
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@contextmanager
+def read_session_scope() -> Iterator[Session]:
+    """Сессия только для чтения: реплика с допустимым отставанием или primary"""
+    db = SessionLocal(bind=read_router.pick())
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
 def create_tables():
     """Создать все таблицы в базе данных"""
     try:
@@ -35,6 +160,192 @@ def create_tables():
         logger.error(f"Error creating database tables: {e}")
         raise
 
+def get_schema_version() -> Optional[int]:
+    """Версия схемы, записанная в БД (None, если схема еще не создана)"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar()
+    except (OperationalError, ProgrammingError):
+        # Таблицы schema_version нет - база пустая или создана до появления версионирования
+        return None
+
+# Ключ advisory lock PostgreSQL, под которым обновляется схема
+SCHEMA_LOCK_KEY = 720_128_028
+
+def _lock_schema(conn):
+    """
+    Не дать нескольким процессам (бот и контейнеры worker) обновлять схему одновременно:
+    остальные ждут, пока первый закончит, и затем видят уже обновленную версию.
+    Блокировка держится до конца транзакции.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+    elif conn.dialect.name == "sqlite":
+        # Блокировка записи на всю базу с начала транзакции
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _read_schema_version(conn) -> Optional[int]:
+    """Версия схемы в рамках текущей транзакции (без ошибки, прерывающей транзакцию PostgreSQL)"""
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return None
+    return conn.execute(select(func.max(SchemaVersion.version))).scalar()
+
+def stamp_schema_version(conn):
+    """Записать текущую версию схемы"""
+    exists = conn.execute(
+        select(SchemaVersion.version).where(SchemaVersion.version == SCHEMA_VERSION)
+    ).first()
+    if not exists:
+        conn.execute(SchemaVersion.__table__.insert().values(version=SCHEMA_VERSION))
+
+def _rebuild_sqlite_table(conn, table):
+    """
+    Пересоздать таблицу SQLite по описанию table с сохранением данных:
+    SQLite не умеет менять ограничения существующих колонок.
+    table - описание таблицы на версии миграции, а не текущая модель: иначе
+    пересоздание добавит колонки, которые добавляют следующие миграции.
+    """
+    old_name = f"{table.name}_old"
+    old_columns = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    old_indexes = [
+        row[0] for row in conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"),
+            {"table": table.name}
+        )
+    ]
+
+    # Внешние ключи других таблиц должны остаться на исходном имени таблицы
+    conn.execute(text("PRAGMA legacy_alter_table = ON"))
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+    for index_name in old_indexes:
+        conn.execute(text(f"DROP INDEX {index_name}"))
+    table.create(conn)
+
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+    conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}"))
+    conn.execute(text(f"DROP TABLE {old_name}"))
+    conn.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+def _referrals_table_v5() -> Table:
+    """Таблица referrals в схеме версии 5 (не менять вместе с моделью)"""
+    return Table(
+        "referrals", MetaData(),
+        Column("id", Integer, primary_key=True, index=True),
+        Column("telegram_user_id", Integer, nullable=False),
+        Column("referrer_first_name", String(255)),
+        Column("referrer_phone", String(50)),
+        Column("referrer_email", String(255)),
+        Column("candidate_full_name", String(255), nullable=False),
+        Column("candidate_phone", String(50), nullable=False),
+        Column("vacancy_type", String(100), nullable=False),
+        Column("citizenship_id", Integer, nullable=False),
+        Column("city_id", String(100), nullable=False),
+        Column("hire_object_uuid", String(100), nullable=False),
+        Column("priority", Integer, nullable=False, server_default="0"),
+        Column("utm_source", String(100)),
+        Column("fullpath", String(500)),
+        Column("rr_flag", String(10)),
+        Column("abt_att", String(10)),
+        Column("submitted_to_ozon", Boolean),
+        Column("submission_attempts", Integer),
+        Column("last_submission_attempt", DateTime),
+        Column("submission_error", Text),
+        Column("claimed_until", DateTime),
+        Column("created_at", DateTime, server_default=func.now()),
+        Column("updated_at", DateTime, server_default=func.now()),
+    )
+
+def _make_referrer_columns_nullable(conn):
+    """Данные реферала переехали в referrer_profiles: колонки в referrals становятся необязательными"""
+    if conn.dialect.name == "sqlite":
+        _rebuild_sqlite_table(conn, _referrals_table_v5())
+        return
+    for column in ("referrer_first_name", "referrer_phone", "referrer_email"):
+        conn.execute(text(f"ALTER TABLE referrals ALTER COLUMN {column} DROP NOT NULL"))
+
+def _has_column(conn, table_name: str, column_name: str) -> bool:
+    return any(column["name"] == column_name for column in inspect(conn).get_columns(table_name))
+
+def _add_result_notified(conn):
+    """Флаг отправленного уведомления; итоги, известные до обновления, повторно не рассылаются"""
+    if _has_column(conn, "referrals", "result_notified"):
+        logger.info("Column referrals.result_notified already exists, skipping")
+        return
+    conn.execute(text("ALTER TABLE referrals ADD COLUMN result_notified BOOLEAN NOT NULL DEFAULT FALSE"))
+    conn.execute(text("CREATE INDEX ix_referrals_result_notified ON referrals (result_notified)"))
+    conn.execute(
+        update(Referral.__table__)
+        .where(or_(
+            Referral.submitted_to_ozon == True,
+            Referral.submission_attempts >= MAX_SUBMISSION_ATTEMPTS
+        ))
+        .values(result_notified=True)
+    )
+
+def _widen_response_body(conn):
+    """Длина тела ответа задается SUBMISSION_BODY_MAX_LENGTH и не должна упираться в VARCHAR(1000)"""
+    if conn.dialect.name == "sqlite":
+        # В SQLite длина VARCHAR не проверяется
+        return
+    conn.execute(text("ALTER TABLE submission_attempts ALTER COLUMN response_body TYPE TEXT"))
+
+# DDL для обновления существующих баз: версия схемы -> выражения или функции от соединения.
+# Новые таблицы создает create_all, здесь только изменения существующих.
+MIGRATIONS = {
+    2: ["ALTER TABLE referrals ADD COLUMN claimed_until TIMESTAMP"],
+    4: ["ALTER TABLE referrals ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"],
+    5: [_make_referrer_columns_nullable],
+    6: [_add_result_notified],
+    7: [_widen_response_body],
+    8: ["ALTER TABLE referrals ADD COLUMN claim_owner VARCHAR(64)"],
+}
+
+def apply_migrations(conn, from_version: int):
+    """Применить миграции к существующей схеме версии from_version"""
+    for version in range(from_version + 1, SCHEMA_VERSION + 1):
+        for statement in MIGRATIONS.get(version, []):
+            if callable(statement):
+                logger.info(f"Applying schema migration {version}: {statement.__name__}")
+                statement(conn)
+            else:
+                logger.info(f"Applying schema migration {version}: {statement}")
+                conn.execute(text(statement))
+
 def init_db():
-    """Инициализация базы данных"""
-    create_tables()
\ No newline at end of file
+    """
+    Инициализация базы данных: создание новой схемы или обновление существующей.
+    Выполняется одной транзакцией под блокировкой схемы.
+    """
+    with engine.begin() as conn:
+        _lock_schema(conn)
+        # Версию читаем под блокировкой: пока ждали, схему мог обновить другой процесс
+        version = _read_schema_version(conn)
+        if version == SCHEMA_VERSION:
+            logger.info(f"Database schema is already at version {SCHEMA_VERSION}")
+            return
+        if version is None and inspect(conn).has_table("referrals"):
+            # База создана до появления таблицы schema_version
+            version = 1
+
+        Base.metadata.create_all(bind=conn)
+        if version is not None and version < SCHEMA_VERSION:
+            apply_migrations(conn, version)
+        stamp_schema_version(conn)
+    logger.info(f"Database schema is at version {SCHEMA_VERSION}")
+
+def ensure_schema():
+    """
+    Быстрая проверка схемы при старте: один SELECT вместо рефлексии create_all.
+    Таблицы создаются, только если версия в БД отстает от кода.
+    """
+    version = get_schema_version()
+    if version == SCHEMA_VERSION:
+        return
+
+    if version is not None and version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than application schema version {SCHEMA_VERSION}"
+        )
+
+    logger.info(f"Database schema version {version} is outdated, upgrading to {SCHEMA_VERSION}")
+    init_db()
@@ -1,22 +1,32 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, false
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 
 Base = declarative_base()
 
+# Версия схемы БД: увеличивать при каждом изменении моделей
+SCHEMA_VERSION = 8
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, server_default=func.now())
+
 class Referral(Base):
     __tablename__ = "referrals"
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_user_id = Column(Integer, nullable=False)
 
-    # Данные реферала (того, кто приглашает)
-    referrer_first_name = Column(String(255), nullable=False)
-    referrer_phone = Column(String(50), nullable=False)
-    referrer_email = Column(String(255), nullable=False)
+    # Данные реферала (того, кто приглашает). Новые заявки берут их из referrer_profiles
+    # по telegram_user_id, здесь они заполнены только у заявок, созданных до появления профилей
+    referrer_first_name = Column(String(255))
+    referrer_phone = Column(String(50))
+    referrer_email = Column(String(255))
 
     # Данные кандидата (того, кого приглашают)
     candidate_full_name = Column(String(255), nullable=False)
@@ -27,6 +37,8 @@ class Referral(Base):
     citizenship_id = Column(Integer, nullable=False)
     city_id = Column(String(100), nullable=False)
     hire_object_uuid = Column(String(100), nullable=False)
+    # Приоритет в очереди отправки: вакансия + город (больше - раньше)
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Системные поля
     utm_source = Column(String(100), default="referral_campaign")
@@ -38,12 +50,42 @@ class Referral(Base):
     submitted_to_ozon = Column(Boolean, default=False)
     submission_attempts = Column(Integer, default=0)
     last_submission_attempt = Column(DateTime)
-    submission_error = Column(Text)
+    submission_error = Column(Text)  # Краткая причина последней неудачи, подробности - в submission_attempts
+    # Заявка взята в работу процессом отправки до этого момента (защита от двойной отправки)
+    claimed_until = Column(DateTime)
+    # Кто закрепил заявку: продлить закрепление и записать результат может только он
+    claim_owner = Column(String(64))
+    # Пользователю отправлено уведомление об итоге (принята Ozon или попытки исчерпаны)
+    result_notified = Column(Boolean, nullable=False, default=False, server_default=false(), index=True)
 
     # Метаданные
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
+class ReferrerProfile(Base):
+    """Данные реферала, общие для всех его заявок"""
+    __tablename__ = "referrer_profiles"
+
+    telegram_user_id = Column(Integer, primary_key=True)
+    first_name = Column(String(255), nullable=False)
+    phone = Column(String(50), nullable=False)
+    email = Column(String(255), nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class SubmissionAttempt(Base):
+    """История попыток отправки на Ozon (только добавление)"""
+    __tablename__ = "submission_attempts"
+
+    id = Column(Integer, primary_key=True)
+    referral_id = Column(Integer, ForeignKey("referrals.id"), nullable=False, index=True)
+    attempt_number = Column(Integer, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+    latency_ms = Column(Integer)
+    status_code = Column(Integer)
+    error_code = Column(String(100))  # Код ошибки из ответа Ozon или класс исключения
+    response_body = Column(Text)  # Тело ответа, обрезанное клиентом Ozon до SUBMISSION_BODY_MAX_LENGTH
+
 # Pydantic модели для API
 class ReferralCreate(BaseModel):
     referrer_first_name: str
@@ -55,6 +97,17 @@ class ReferralCreate(BaseModel):
     citizenship_id: int = 7  # По умолчанию Россия
     city_id: str
     hire_object_uuid: str
+    fullpath: Optional[str] = None  # Посадочная страница вакансии
+    priority: int = 0
+
+class ReferrerProfileData(BaseModel):
+    """Неизменяемый снимок профиля реферала для кэша"""
+    first_name: str
+    phone: str
+    email: str
+
+    class Config:
+        frozen = True
 
 class ReferralResponse(ReferralCreate):
     id: int
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+from config.settings import REFERRER_CACHE_SIZE, REFERRER_CACHE_TTL_SECONDS
+from .models import ReferrerProfileData
+
+
+class ProfileCache:
+    """
+    LRU кэш с ограничением времени жизни записей.
+
+    Хранит неизменяемые снимки, поэтому значения можно отдавать
+    в обработчики без копирования. TTL ограничивает расхождение
+    с БД, если профиль изменили в другом процессе.
+    """
+
+    def __init__(self, max_size: int = REFERRER_CACHE_SIZE, ttl: float = REFERRER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # ключ -> (время записи, значение); порядок - от давно использованных к недавним
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[ReferrerProfileData]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: ReferrerProfileData):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Размер и попадания кэша для мониторинга"""
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Профили рефералов по telegram_user_id (свой кэш у каждого процесса)
+referrer_profiles = ProfileCache()
@@ -1,103 +1,172 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func, select, update
 from datetime import datetime, timedelta
+from config.settings import MAX_SUBMISSION_ATTEMPTS
 from typing import List, Optional, Dict
-from .models import Referral, ReferralCreate
+from .models import Referral, ReferralCreate, ReferrerProfile, ReferrerProfileData, SubmissionAttempt
+from .profile_cache import referrer_profiles
 from .database import SessionLocal
+from .submission_queue import pending_conditions
+from monitoring.profiling import instrument
 import logging
 
 logger = logging.getLogger(__name__)
 
+@instrument
 class ReferralService:
-    def __init__(self, db: Session = None):
+    def __init__(self, db: Session = None, read_db: Session = None):
         self.db = db or SessionLocal()
+        # Сессия для отчетных запросов (реплика); без нее все читается из основной сессии
+        self.read_db = read_db or self.db
+
+    def get_referrer_profile(self, telegram_user_id: int) -> Optional[ReferrerProfileData]:
+        """Профиль реферала: из кэша процесса, иначе из основной БД (None, если профиля нет)"""
+        cached = referrer_profiles.get(telegram_user_id)
+        if cached is not None:
+            return cached
+
+        profile = self.db.get(ReferrerProfile, telegram_user_id)
+        if profile is None:
+            return None
+
+        data = ReferrerProfileData(first_name=profile.first_name, phone=profile.phone, email=profile.email)
+        referrer_profiles.put(telegram_user_id, data)
+        return data
+
+    def _save_referrer_profile(self, telegram_user_id: int, data: ReferrerProfileData):
+        """Создать или обновить профиль реферала (без commit); неизменный профиль не пишется"""
+        if self.get_referrer_profile(telegram_user_id) == data:
+            return
+
+        profile = self.db.get(ReferrerProfile, telegram_user_id)
+        if profile is None:
+            self.db.add(ReferrerProfile(telegram_user_id=telegram_user_id, **data.model_dump()))
+        else:
+            profile.first_name = data.first_name
+            profile.phone = data.phone
+            profile.email = data.email
+        # Кэш обновится после commit; до этого старое значение не должно отдаваться
+        referrer_profiles.invalidate(telegram_user_id)
 
     def create_referral(self, telegram_user_id: int, referral_data: ReferralCreate) -> Referral:
-        """Создать новую запись реферала"""
+        """
+        Создать новую запись реферала. Данные реферала сохраняются
+        в его профиль, а не копируются в каждую заявку.
+        """
+        profile_data = ReferrerProfileData(
+            first_name=referral_data.referrer_first_name,
+            phone=referral_data.referrer_phone,
+            email=referral_data.referrer_email
+        )
+        self._save_referrer_profile(telegram_user_id, profile_data)
+
         db_referral = Referral(
             telegram_user_id=telegram_user_id,
-            referrer_first_name=referral_data.referrer_first_name,
-            referrer_phone=referral_data.referrer_phone,
-            referrer_email=referral_data.referrer_email,
             candidate_full_name=referral_data.candidate_full_name,
             candidate_phone=referral_data.candidate_phone,
             vacancy_type=referral_data.vacancy_type,
             citizenship_id=referral_data.citizenship_id,
             city_id=referral_data.city_id,
-            hire_object_uuid=referral_data.hire_object_uuid
+            hire_object_uuid=referral_data.hire_object_uuid,
+            priority=referral_data.priority
         )
+        if referral_data.fullpath:
+            db_referral.fullpath = referral_data.fullpath
 
         self.db.add(db_referral)
         self.db.commit()
         self.db.refresh(db_referral)
+        referrer_profiles.put(telegram_user_id, profile_data)
 
         logger.info(f"Created new referral ID {db_referral.id} for user {telegram_user_id}")
         return db_referral
 
-    def get_pending_submissions(self, limit: int = 50) -> List[Referral]:
-        """Получить рефералов, ожидающих отправки на Ozon"""
-        return self.db.query(Referral).filter(
-            and_(
-                Referral.submitted_to_ozon == False,
-                Referral.submission_attempts < 3
-            )
-        ).order_by(Referral.created_at).limit(limit).all()
-
-    def update_submission_status(self, referral_id: int, success: bool, error: str = None):
-        """Обновить статус отправки реферала"""
-        referral = self.db.query(Referral).filter(Referral.id == referral_id).first()
-        if not referral:
-            logger.error(f"Referral ID {referral_id} not found")
-            return
-
-        referral.submission_attempts += 1
-        referral.last_submission_attempt = datetime.utcnow()
-
-        if success:
-            referral.submitted_to_ozon = True
-            referral.submission_error = None
-            logger.info(f"Referral ID {referral_id} successfully submitted")
-        else:
-            referral.submission_error = error
-            logger.warning(f"Referral ID {referral_id} submission failed: {error}")
-
-        self.db.commit()
-
     def get_referral_by_id(self, referral_id: int) -> Optional[Referral]:
         """Получить реферала по ID"""
         return self.db.query(Referral).filter(Referral.id == referral_id).first()
 
+    def take_unnotified_results(self, limit: int = 100) -> List:
+        """
+        Забрать итоги отправки, о которых пользователь еще не знает (принята Ozon
+        или попытки исчерпаны), и отметить их уведомленными. Работает по основной БД,
+        поэтому видит результаты любого процесса отправки.
+        Возвращает строки (id, telegram_user_id, candidate_full_name, submitted_to_ozon, submission_attempts).
+        """
+        unnotified_ids = (
+            select(Referral.id)
+            .where(
+                Referral.result_notified == False,
+                or_(
+                    Referral.submitted_to_ozon == True,
+                    Referral.submission_attempts >= MAX_SUBMISSION_ATTEMPTS
+                )
+            )
+            .order_by(Referral.id)
+            .limit(limit)
+            .scalar_subquery()
+        )
+        rows = self.db.execute(
+            update(Referral)
+            .where(Referral.id.in_(unnotified_ids), Referral.result_notified == False)
+            .values(result_notified=True)
+            .returning(
+                Referral.id, Referral.telegram_user_id, Referral.candidate_full_name,
+                Referral.submitted_to_ozon, Referral.submission_attempts
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        self.db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
     def get_user_referrals(self, telegram_user_id: int) -> List[Referral]:
         """Получить все рефералы пользователя"""
-        return self.db.query(Referral).filter(
+        return self.read_db.query(Referral).filter(
             Referral.telegram_user_id == telegram_user_id
         ).order_by(Referral.created_at.desc()).all()
 
+    def get_user_ids(self) -> List[int]:
+        """Получить Telegram ID всех пользователей, отправлявших рефералов"""
+        rows = self.read_db.query(Referral.telegram_user_id).distinct().all()
+        return [row[0] for row in rows]
+
+    def get_recent_attempts_summary(self, minutes: int = 15) -> Dict[str, Optional[float]]:
+        """Сводка попыток отправки за последние N минут: количество, успешные, средняя задержка"""
+        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
+        attempts, successes, avg_latency = self.read_db.query(
+            func.count(SubmissionAttempt.id),
+            func.count(SubmissionAttempt.id).filter(SubmissionAttempt.status_code == 200),
+            func.avg(SubmissionAttempt.latency_ms)
+        ).filter(SubmissionAttempt.created_at >= cutoff_time).one()
+        return {
+            "attempts": attempts,
+            "successes": successes,
+            "avg_latency_ms": float(avg_latency) if avg_latency is not None else None
+        }
+
+    def get_oldest_pending_created_at(self) -> Optional[datetime]:
+        """Время создания самой старой заявки, ожидающей отправки"""
+        return self.read_db.query(func.min(Referral.created_at)).filter(*pending_conditions()).scalar()
+
     def get_failed_submissions(self, hours_ago: int = 24) -> List[Referral]:
         """Получить рефералов с неудачными отправками за последние N часов"""
         cutoff_time = datetime.utcnow() - timedelta(hours=hours_ago)
-        return self.db.query(Referral).filter(
+        return self.read_db.query(Referral).filter(
             and_(
                 Referral.submitted_to_ozon == False,
                 Referral.last_submission_attempt >= cutoff_time,
-                Referral.submission_attempts >= 3
+                Referral.submission_attempts >= MAX_SUBMISSION_ATTEMPTS
             )
         ).all()
 
     def get_submission_stats(self) -> Dict[str, int]:
         """Получить статистику отправок"""
-        total = self.db.query(Referral).count()
-        submitted = self.db.query(Referral).filter(Referral.submitted_to_ozon == True).count()
-        pending = self.db.query(Referral).filter(
-            and_(
-                Referral.submitted_to_ozon == False,
-                Referral.submission_attempts < 3
-            )
-        ).count()
-        failed = self.db.query(Referral).filter(
+        total = self.read_db.query(Referral).count()
+        submitted = self.read_db.query(Referral).filter(Referral.submitted_to_ozon == True).count()
+        pending = self.read_db.query(Referral).filter(*pending_conditions()).count()
+        failed = self.read_db.query(Referral).filter(
             and_(
                 Referral.submitted_to_ozon == False,
-                Referral.submission_attempts >= 3
+                Referral.submission_attempts >= MAX_SUBMISSION_ATTEMPTS
             )
         ).count()
 
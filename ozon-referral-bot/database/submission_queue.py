@@ -0,0 +1,264 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, update, insert, func, select
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import uuid
+from config.settings import MAX_SUBMISSION_ATTEMPTS, SUBMIT_RETRY_BACKOFF_SECONDS
+from .models import Referral, ReferrerProfile, SubmissionAttempt
+from monitoring.profiling import instrument
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Длина краткой причины ошибки в строке referrals
+SUBMISSION_ERROR_MAX_LENGTH = 255
+
+
+def _referrer_field(referral_column, profile_column):
+    """Данные реферала: у старых заявок - из самой заявки, у новых - из профиля"""
+    return func.coalesce(referral_column, profile_column).label(referral_column.key)
+
+
+# Колонки, которые нужны процессу отправки: payload для Ozon и данные для уведомления
+PAYLOAD_COLUMNS = (
+    Referral.id,
+    Referral.telegram_user_id,
+    _referrer_field(Referral.referrer_first_name, ReferrerProfile.first_name),
+    _referrer_field(Referral.referrer_phone, ReferrerProfile.phone),
+    _referrer_field(Referral.referrer_email, ReferrerProfile.email),
+    Referral.candidate_full_name,
+    Referral.candidate_phone,
+    Referral.vacancy_type,
+    Referral.citizenship_id,
+    Referral.city_id,
+    Referral.hire_object_uuid,
+    Referral.utm_source,
+    Referral.fullpath,
+    Referral.rr_flag,
+    Referral.abt_att,
+    Referral.submission_attempts,
+)
+
+
+class PendingSubmission:
+    """
+    Заявка в работе у процесса отправки: только нужные колонки, без ORM.
+
+    Не попадает в identity map сессии, не отслеживает изменения и не
+    перечитывается после commit. Атрибуты совпадают с Referral, поэтому
+    OzonAPIClient и уведомления работают с ней так же, как с моделью.
+    """
+
+    __slots__ = tuple(column.key for column in PAYLOAD_COLUMNS)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        return f"PendingSubmission(id={self.id}, attempts={self.submission_attempts})"
+
+
+def _payload_query(referral_ids: List[int]):
+    """Данные для отправки по ID заявок; профиль присоединяется явным JOIN"""
+    return (
+        select(*PAYLOAD_COLUMNS)
+        .select_from(Referral)
+        .outerjoin(ReferrerProfile, ReferrerProfile.telegram_user_id == Referral.telegram_user_id)
+        .where(Referral.id.in_(referral_ids))
+    )
+
+
+def pending_conditions(unclaimed_only: bool = False) -> list:
+    """Условия отбора ожидающих заявок"""
+    conditions = [
+        Referral.submitted_to_ozon == False,
+        Referral.submission_attempts < MAX_SUBMISSION_ATTEMPTS
+    ]
+    if unclaimed_only:
+        conditions.append(_unclaimed(datetime.utcnow()))
+    return conditions
+
+
+def _unclaimed(now: datetime):
+    return or_(Referral.claimed_until.is_(None), Referral.claimed_until < now)
+
+
+def retry_backoff(attempts: int) -> float:
+    """Пауза перед следующей попыткой после attempts неудачных, секунд"""
+    return SUBMIT_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1) if attempts else 0.0
+
+
+def _retry_due(now: datetime):
+    """
+    Экспоненциальная пауза между попытками: без нее неудачная заявка сразу
+    попадает в следующую пачку, и короткая пачка 429 или окно 403 сжигают
+    все MAX_SUBMISSION_ATTEMPTS за секунду.
+    """
+    conditions = [Referral.submission_attempts == 0, Referral.last_submission_attempt.is_(None)]
+    for attempts in range(1, MAX_SUBMISSION_ATTEMPTS):
+        conditions.append(and_(
+            Referral.submission_attempts == attempts,
+            Referral.last_submission_attempt < now - timedelta(seconds=retry_backoff(attempts))
+        ))
+    return or_(*conditions)
+
+
+def fair_pending_ids_query(limit: int, unclaimed_only: bool = False):
+    """
+    ID ожидающих рефералов в порядке справедливой очереди: сначала более
+    высокий приоритет, внутри приоритета - по кругу между пользователями
+    (первая заявка каждого, затем вторая и т.д.), затем по времени создания.
+    Массовая загрузка одного пользователя не задерживает заявки остальных.
+    Заявки, у которых не истекла пауза после неудачной попытки, пропускаются.
+    """
+    user_rank = func.row_number().over(
+        partition_by=(Referral.priority, Referral.telegram_user_id),
+        order_by=(Referral.created_at, Referral.id)
+    ).label("user_rank")
+    queue = (
+        select(Referral.id, Referral.priority, Referral.created_at, user_rank)
+        .where(*pending_conditions(unclaimed_only), _retry_due(datetime.utcnow()))
+        .subquery()
+    )
+    return (
+        select(queue.c.id)
+        .order_by(queue.c.priority.desc(), queue.c.user_rank, queue.c.created_at, queue.c.id)
+        .limit(limit)
+    )
+
+
+@instrument
+class SubmissionQueue:
+    """
+    Путь данных процесса отправки на уровне Core: заявки закрепляются
+    одним UPDATE ... RETURNING id, их данные читаются одним SELECT,
+    результаты пишутся прямыми UPDATE/INSERT без загрузки моделей.
+    """
+
+    def __init__(self, db: Session, owner: Optional[str] = None):
+        self.db = db
+        # Метка закреплений этой очереди: чужие закрепления она не продлевает и не перезаписывает
+        self.owner = owner or uuid.uuid4().hex
+
+    def _owned(self, referral_id: int):
+        return (Referral.id == referral_id, Referral.claim_owner == self.owner)
+
+    def _claim(self, conditions, lease_seconds: int) -> List[PendingSubmission]:
+        """Атомарно закрепить за собой свободные заявки и получить их данные"""
+        now = datetime.utcnow()
+        # Только id: SQLite выводит RETURNING без имен таблиц, и коррелированный
+        # подзапрос к профилю в нем сравнивал бы колонку профиля саму с собой
+        stmt = (
+            update(Referral)
+            .where(*conditions, _unclaimed(now))
+            .values(claimed_until=now + timedelta(seconds=lease_seconds), claim_owner=self.owner)
+            .returning(Referral.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed_ids = [row[0] for row in self.db.execute(stmt)]
+        claimed = [PendingSubmission(*row) for row in self.db.execute(_payload_query(claimed_ids))] if claimed_ids else []
+        self.db.commit()
+        return claimed
+
+    def claim_batch(self, limit: int = 50, lease_seconds: int = 600) -> List[PendingSubmission]:
+        """
+        Получить ожидающие заявки и закрепить их за текущим процессом,
+        чтобы параллельные процессы отправки не отправили их повторно
+        """
+        candidate_ids = [row[0] for row in self.db.execute(fair_pending_ids_query(limit, unclaimed_only=True))]
+        if not candidate_ids:
+            return []
+
+        # Паузу проверяем повторно: другой процесс мог записать неудачу после выборки.
+        # RETURNING не сохраняет порядок - восстанавливаем порядок справедливой очереди
+        claimed = {
+            item.id: item
+            for item in self._claim([Referral.id.in_(candidate_ids), _retry_due(datetime.utcnow())], lease_seconds)
+        }
+        return [claimed[referral_id] for referral_id in candidate_ids if referral_id in claimed]
+
+    def claim_one(self, referral_id: int, lease_seconds: int = 600) -> Optional[PendingSubmission]:
+        """Закрепить конкретную неотправленную заявку (None, если она занята или уже отправлена)"""
+        claimed = self._claim(
+            [Referral.id == referral_id, Referral.submitted_to_ozon == False],
+            lease_seconds
+        )
+        return claimed[0] if claimed else None
+
+    def renew(self, item: PendingSubmission, lease_seconds: int = 600) -> bool:
+        """
+        Продлить закрепление перед отправкой. False - закрепление истекло
+        и заявку забрал другой процесс (или она уже отправлена): отправлять нельзя.
+        """
+        renewed = self.db.execute(
+            update(Referral)
+            .where(*self._owned(item.id), Referral.submitted_to_ozon == False)
+            .values(claimed_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        self.db.commit()
+        if not renewed:
+            logger.warning(f"Referral ID {item.id} claim was lost, skipping it")
+        return bool(renewed)
+
+    def release(self, referral_ids: List[int]):
+        """Вернуть необработанные заявки в очередь (только закрепленные этой очередью)"""
+        if not referral_ids:
+            return
+        self.db.execute(
+            update(Referral)
+            .where(Referral.id.in_(referral_ids), Referral.claim_owner == self.owner)
+            .values(claimed_until=None, claim_owner=None)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        logger.info(f"Released {len(referral_ids)} claimed referrals back to the queue")
+
+    def record_result(self, item: PendingSubmission, success: bool, error: str = None,
+                      attempt: Optional[Dict] = None):
+        """
+        Записать результат отправки: сводка в строке referrals и попытка в истории.
+        Ничего не пишется, если заявка уже закреплена за другим процессом.
+
+        attempt - результат OzonAPIClient.submit_referral (status_code, latency_ms,
+        error_code, response_text - уже обрезан клиентом). item.submission_attempts обновляется на месте.
+        """
+        values = {
+            "submission_attempts": Referral.submission_attempts + 1,
+            "last_submission_attempt": datetime.utcnow(),
+            "claimed_until": None,
+            "claim_owner": None,
+        }
+        if success:
+            values.update(submitted_to_ozon=True, submission_error=None)
+            logger.info(f"Referral ID {item.id} successfully submitted")
+        else:
+            values["submission_error"] = error[:SUBMISSION_ERROR_MAX_LENGTH] if error else error
+            logger.warning(f"Referral ID {item.id} submission failed: {values['submission_error']}")
+
+        attempt_number = self.db.execute(
+            update(Referral)
+            .where(*self._owned(item.id))
+            .values(**values)
+            .returning(Referral.submission_attempts)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if attempt_number is None:
+            self.db.rollback()
+            logger.error(f"Referral ID {item.id} is no longer claimed by this worker, result not recorded")
+            return
+        item.submission_attempts = attempt_number
+
+        attempt = attempt or {}
+        self.db.execute(
+            insert(SubmissionAttempt).values(
+                referral_id=item.id,
+                attempt_number=attempt_number,
+                latency_ms=attempt.get("latency_ms"),
+                status_code=attempt.get("status_code"),
+                error_code=attempt.get("error_code"),
+                response_body=attempt.get("response_text")
+            )
+        )
+        self.db.commit()
@@ -3,21 +3,25 @@
 Ozon Referral Bot - Telegram бот для сбора рефералов и автоматической отправки на Ozon
 
 Запуск:
-    python main.py
+    python main.py [bot]          - Telegram бот (по умолчанию)
+    python main.py worker         - только отправка заявок на Ozon, без Telegram (WORKER_PROCESSES процессов)
+    python main.py admin <cmd>    - административные команды (init-db, check-schema, stats)
+
+Каждый режим импортирует только свою подсистему, поэтому worker и admin
+не загружают python-telegram-bot, а admin stats не трогает Ozon клиент.
 
 Требуемые переменные окружения:
-    TELEGRAM_BOT_TOKEN - токен Telegram бота
+    TELEGRAM_BOT_TOKEN - токен Telegram бота (только для режима bot)
     DATABASE_URL - URL подключения к PostgreSQL (опционально, по умолчанию sqlite)
     REDIS_URL - URL Redis (опционально)
     OZON_COOKIE - Cookie для Ozon API (опционально)
 """
 
+import argparse
 import logging
 import sys
 from loguru import logger
-from config.settings import LOG_LEVEL, LOG_FILE
-from database.database import init_db
-from bot.bot import OzonReferralBot
+from config.settings import LOG_LEVEL, LOG_FILE, WORKER_PROCESSES
 
 def setup_logging():
     """Настройка логирования"""
@@ -50,22 +54,75 @@ def setup_logging():
     logging.getLogger().addHandler(InterceptHandler())
     logging.getLogger().setLevel(LOG_LEVEL)
 
+def run_bot(args):
+    """Режим Telegram бота"""
+    from database.database import ensure_schema
+    from bot.bot import OzonReferralBot
+
+    logger.info("Checking database schema...")
+    ensure_schema()
+
+    logger.info("Starting Telegram bot...")
+    bot = OzonReferralBot()
+    bot.run()
+
+def run_worker(args):
+    """Режим отправки заявок на Ozon без Telegram: несколько процессов отправки"""
+    from database.database import ensure_schema
+    from bot.worker import WorkerPool
+
+    logger.info("Checking database schema...")
+    ensure_schema()
+
+    processes = args.processes or WORKER_PROCESSES
+    logger.info(f"Starting {processes} submission worker processes...")
+    WorkerPool(processes, setup_logging=setup_logging).run()
+
+def run_admin(args):
+    """Административные команды"""
+    if args.command == "init-db":
+        from database.database import init_db
+        init_db()
+    elif args.command == "check-schema":
+        from database.database import get_schema_version
+        from database.models import SCHEMA_VERSION
+        version = get_schema_version()
+        logger.info(f"Database schema version: {version}, application schema version: {SCHEMA_VERSION}")
+        if version != SCHEMA_VERSION:
+            sys.exit(2)
+    elif args.command == "stats":
+        from database.database import read_session_scope
+        from database.referral_service import ReferralService
+        with read_session_scope() as read_db:
+            stats = ReferralService(read_db, read_db=read_db).get_submission_stats()
+        for key, value in stats.items():
+            logger.info(f"{key}: {value}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ozon Referral Bot")
+    subparsers = parser.add_subparsers(dest="mode")
+
+    subparsers.add_parser("bot", help="Запустить Telegram бота")
+    worker_parser = subparsers.add_parser("worker", help="Запустить отправку заявок на Ozon")
+    worker_parser.add_argument("--processes", type=int, help="Количество процессов отправки (WORKER_PROCESSES)")
+    admin_parser = subparsers.add_parser("admin", help="Административные команды")
+    admin_parser.add_argument("command", choices=["init-db", "check-schema", "stats"])
+
+    args = parser.parse_args(argv)
+    args.mode = args.mode or "bot"
+    return args
+
 def main():
     """Главная функция"""
+    args = parse_args()
+    handlers = {"bot": run_bot, "worker": run_worker, "admin": run_admin}
+
     try:
         # Настраиваем логирование
         setup_logging()
 
-        logger.info("Starting Ozon Referral Bot...")
-
-        # Инициализируем базу данных
-        logger.info("Initializing database...")
-        init_db()
-
-        # Создаем и запускаем бота
-        logger.info("Starting Telegram bot...")
-        bot = OzonReferralBot()
-        bot.run()
+        logger.info(f"Starting Ozon Referral Bot ({args.mode})...")
+        handlers[args.mode](args)
 
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
@@ -74,4 +131,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
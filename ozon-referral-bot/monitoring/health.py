@@ -0,0 +1,204 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+from config.settings import (
+    REDIS_URL, HEALTH_PORT, HEALTH_CACHE_SECONDS, HEALTH_OZON_CACHE_SECONDS,
+    HEALTH_OZON_WINDOW_MINUTES, HEALTH_MAX_QUEUE_LAG_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Последние запуски фоновых задач, видимые этому процессу: имя -> (time.time(), состояние)
+_heartbeats: Dict[str, Tuple[float, Optional[dict]]] = {}
+
+# Куда дополнительно передавать отметки: в режиме worker - очередь родительского процесса,
+# который отвечает на /readyz
+_heartbeat_sink: Optional[Callable[[str, float, Optional[dict]], None]] = None
+
+
+def set_heartbeat_sink(sink: Optional[Callable[[str, float, Optional[dict]], None]]):
+    """Передавать каждую отметку heartbeat в sink(name, time, state)"""
+    global _heartbeat_sink
+    _heartbeat_sink = sink
+
+
+def heartbeat(name: str, state: Optional[dict] = None, at: Optional[float] = None):
+    """
+    Отметить, что фоновая задача (например, планировщик) отработала.
+    at - время отметки, если она пришла из другого процесса.
+    """
+    at = time.time() if at is None else at
+    _heartbeats[name] = (at, state)
+    if _heartbeat_sink is not None:
+        try:
+            _heartbeat_sink(name, at, state)
+        except Exception as e:
+            logger.warning(f"Failed to forward heartbeat {name}: {e}")
+
+
+class HealthMonitor:
+    """
+    Проверки готовности: БД, Redis, доступность Ozon и отставание очереди отправки.
+
+    Результат каждой проверки кэшируется на свой TTL, поэтому частые запросы
+    оркестратора не создают нагрузку. Критичная проверка (БД) переводит статус
+    в fail, остальные - в degraded.
+    """
+
+    def __init__(self, ozon_client=None):
+        self.ozon_client = ozon_client
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, dict]] = {}
+        # имя -> (проверка, TTL кэша, критичность)
+        self.checks: Dict[str, Tuple[Callable[[], dict], float, bool]] = {
+            "database": (self.check_database, HEALTH_CACHE_SECONDS, True),
+            "redis": (self.check_redis, HEALTH_CACHE_SECONDS, False),
+            "ozon": (self.check_ozon, HEALTH_OZON_CACHE_SECONDS, False),
+            "queue": (self.check_queue_lag, HEALTH_CACHE_SECONDS, False),
+        }
+
+    def _run_cached(self, name: str) -> dict:
+        check, ttl, _ = self.checks[name]
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached and now - cached[0] < ttl:
+                return cached[1]
+
+        try:
+            result = check()
+        except Exception as e:
+            result = {"status": "fail", "error": f"{type(e).__name__}: {e}"}
+
+        with self._lock:
+            self._cache[name] = (time.monotonic(), result)
+        return result
+
+    def readiness(self) -> dict:
+        """Сводный статус готовности: ok, degraded или fail"""
+        results = {name: self._run_cached(name) for name in self.checks}
+
+        status = "ok"
+        for name, result in results.items():
+            if result["status"] == "fail":
+                if self.checks[name][2]:
+                    status = "fail"
+                    break
+                status = "degraded"
+
+        return {"status": status, "checks": results}
+
+    def check_database(self) -> dict:
+        from database.database import engine, read_router
+        from sqlalchemy import text
+
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        result = {
+            "status": "ok",
+            "latency_ms": int((time.perf_counter() - started) * 1000),
+            "pool": engine.pool.status()
+        }
+        if read_router.replicas:
+            result["replicas"] = read_router.status()
+        return result
+
+    def check_redis(self) -> dict:
+        if not REDIS_URL:
+            return {"status": "skip"}
+        try:
+            import redis
+        except ImportError:
+            return {"status": "skip", "detail": "redis package is not installed"}
+
+        client = redis.Redis.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+        try:
+            client.ping()
+        finally:
+            client.close()
+        return {"status": "ok"}
+
+    def check_ozon(self) -> dict:
+        """
+        Доступность Ozon по результатам недавних отправок; HEAD запрос -
+        только если отправок не было.
+        """
+        from database.database import read_session_scope
+        from database.referral_service import ReferralService
+
+        with read_session_scope() as read_db:
+            summary = ReferralService(read_db, read_db=read_db).get_recent_attempts_summary(HEALTH_OZON_WINDOW_MINUTES)
+
+        if summary["attempts"]:
+            status = "ok" if summary["successes"] else "fail"
+            return {"status": status, "source": "recent_submissions", **summary}
+
+        if self.ozon_client is None:
+            return {"status": "skip", "detail": "no recent submissions"}
+
+        reachable = self.ozon_client.test_connection()
+        return {"status": "ok" if reachable else "fail", "source": "head_request"}
+
+    def check_queue_lag(self) -> dict:
+        """Отставание отправки: возраст самой старой ожидающей заявки и последний запуск планировщика"""
+        from database.database import read_session_scope
+        from database.referral_service import ReferralService
+
+        with read_session_scope() as read_db:
+            oldest = ReferralService(read_db, read_db=read_db).get_oldest_pending_created_at()
+
+        lag = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+        result = {
+            "status": "ok" if lag <= HEALTH_MAX_QUEUE_LAG_SECONDS else "fail",
+            "oldest_pending_seconds": int(lag)
+        }
+        for name, (last_run, state) in list(_heartbeats.items()):
+            result[f"{name}_last_run_seconds_ago"] = int(time.time() - last_run)
+            if state is not None:
+                result[f"{name}_state"] = state
+        return result
+
+
+class _HealthRequestHandler(BaseHTTPRequestHandler):
+    monitor: Optional[HealthMonitor] = None
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            # Liveness: процесс отвечает - этого достаточно, никаких проверок
+            self._respond(200, {"status": "ok"})
+        elif self.path == "/readyz":
+            report = self.monitor.readiness()
+            self._respond(503 if report["status"] == "fail" else 200, report)
+        else:
+            self._respond(404, {"status": "not_found"})
+
+    def _respond(self, code: int, body: dict):
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Пробы оркестратора приходят часто - не засоряем логи
+        pass
+
+
+def start_health_server(monitor: HealthMonitor, port: int = HEALTH_PORT) -> Optional[ThreadingHTTPServer]:
+    """Запустить HTTP сервер проверок (/healthz, /readyz) в фоновом потоке; port=0 - не запускать"""
+    if not port:
+        return None
+
+    handler = type("HealthRequestHandler", (_HealthRequestHandler,), {"monitor": monitor})
+    server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="health-server", daemon=True)
+    thread.start()
+    logger.info(f"Health endpoint listening on port {port} (/healthz, /readyz)")
+    return server
@@ -0,0 +1,134 @@
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+from config.settings import PROFILING_ENABLED, PROFILE_SAMPLE_INTERVAL
+
+# Накопленные тайминги: имя -> [количество вызовов, суммарное время, максимум]
+_timings: Dict[str, List[float]] = {}
+_timings_lock = threading.Lock()
+
+# Одновременно работает только один сэмплирующий профайлер
+_sampler_lock = threading.Lock()
+
+
+def record_timing(name: str, elapsed: float):
+    """Учесть один вызов длительностью elapsed секунд"""
+    with _timings_lock:
+        stats = _timings.get(name)
+        if stats is None:
+            _timings[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+
+def get_timings() -> List[Tuple[str, int, float, float, float]]:
+    """Тайминги (имя, вызовов, всего, среднее, максимум), по убыванию суммарного времени"""
+    with _timings_lock:
+        rows = [(name, int(count), total, total / count, maximum) for name, (count, total, maximum) in _timings.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def reset_timings():
+    """Сбросить накопленные тайминги"""
+    with _timings_lock:
+        _timings.clear()
+
+
+def format_timings(limit: int = 15) -> str:
+    """Текстовая сводка самых затратных вызовов"""
+    rows = get_timings()[:limit]
+    if not rows:
+        return "Нет данных (PROFILING_ENABLED=false или вызовов еще не было)"
+    return "\n".join(
+        f"{name}: {count} вызовов, всего {total:.2f}с, среднее {avg * 1000:.1f}мс, макс {maximum * 1000:.1f}мс"
+        for name, count, total, avg, maximum in rows
+    )
+
+
+def timed(name: str):
+    """
+    Декоратор замера времени вызова (синхронного или асинхронного).
+    Если профилирование выключено, функция возвращается без обертки - накладных расходов нет.
+    """
+    def decorator(func):
+        if not PROFILING_ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record_timing(name, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_timing(name, time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+def instrument(cls):
+    """Декоратор класса: замер всех публичных методов под именем Класс.метод"""
+    if not PROFILING_ENABLED:
+        return cls
+
+    for attr_name, attr in list(vars(cls).items()):
+        if attr_name.startswith("_") or not inspect.isfunction(attr):
+            continue
+        setattr(cls, attr_name, timed(f"{cls.__name__}.{attr_name}")(attr))
+    return cls
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # Строка начала функции, а не текущая: одинаковые функции склеиваются в один блок flamegraph
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> str:
+    """
+    Сэмплирующий профайлер всего процесса: каждые interval секунд снимает стеки
+    всех потоков. Возвращает свернутые стеки (формат flamegraph.pl / speedscope):
+    "поток;функция;функция N" на строку.
+    """
+    if not _sampler_lock.acquire(blocking=False):
+        raise RuntimeError("Profiler is already running")
+
+    try:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    finally:
+        _sampler_lock.release()
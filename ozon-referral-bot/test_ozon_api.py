@@ -4,13 +4,13 @@
 """
 
 import json
+from types import SimpleNamespace
 from api.ozon_client import OzonAPIClient
-from database.models import Referral
 from loguru import logger
 
 def create_test_referral():
-    """Создать тестовый реферал"""
-    return Referral(
+    """Создать тестовый реферал (без SQLAlchemy: клиенту нужны только атрибуты)"""
+    return SimpleNamespace(
         id=1,
         telegram_user_id=123456789,
         referrer_first_name="Тестовый Реферал",
@@ -22,6 +22,10 @@ def create_test_referral():
         citizenship_id=7,
         city_id="73d7119e-1e3c-11e9-90e9-9418826ee072",
         hire_object_uuid="51761b1a-1c00-11ef-9463-525400d5f71a",
+        utm_source="referral_campaign",
+        fullpath="https://recruitment.ozon.ru/ref-courier-sklad",
+        rr_flag="1",
+        abt_att="1",
         submitted_to_ozon=False,
         submission_attempts=0
     )